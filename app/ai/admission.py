@@ -0,0 +1,163 @@
+"""
+Admission control for LLM work.
+
+Three layers, cheapest first:
+- load shedding on the job queue backlog: multi replies degrade to one
+  persona, then chains and scheduled threads are skipped outright;
+- token buckets per language (all AI generations) and per thread
+  (autonomous posts, AI_POSTS_PER_HOUR plus AI_REPLY_COOLDOWN_SECONDS);
+  when empty the caller is told how long to wait instead of calling the model;
+- a concurrency cap per backend URL around every model request.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from app.ai.config import settings
+from app.job_queue import job_queue
+
+# Thread buckets kept in memory; an evicted thread simply starts full again
+THREAD_BUCKETS_MAX = 10000
+
+# Generation kinds
+HUMAN = "human"          # reply a user asked for
+CHAIN = "chain"          # AI answering AI
+SCHEDULED = "scheduled"  # periodic thread
+AUTONOMOUS = (CHAIN, SCHEDULED)
+
+
+class TokenBucket:
+    """Not thread-safe on its own; AdmissionController holds its lock around it."""
+
+    def __init__(self, per_hour: float):
+        self.capacity = max(1.0, float(per_hour))
+        self.rate = max(per_hour, 0.0) / 3600.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 if one is there now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate else float("inf")
+
+    def take(self):
+        self.tokens -= 1
+
+
+@dataclass(frozen=True)
+class Admission:
+    admitted: bool
+    max_personas: Optional[int] = None  # None: no cap
+    retry_after: float = 0.0            # > 0: rate limited, try again then
+    reason: str = ""
+
+
+class _Backend:
+    def __init__(self, limit: int):
+        self.sem = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.active = 0
+
+
+class AdmissionController:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lang_buckets: Dict[str, TokenBucket] = {}
+        # thread_id -> (bucket, monotonic time of the last autonomous post)
+        self._threads: "OrderedDict[int, list]" = OrderedDict()
+        self._backends: Dict[str, _Backend] = {}
+
+    # --- rate limits and shedding ------------------------------------------
+
+    def admit(self, kind: str, lang: str, thread_id: Optional[int] = None) -> Admission:
+        backlog = job_queue.depth()
+        if kind in AUTONOMOUS and backlog >= settings.AI_SHED_SKIP_DEPTH:
+            return Admission(False, reason=f"shed (backlog {backlog})")
+
+        now = time.monotonic()
+        with self._lock:
+            lang_bucket = self._lang_buckets.get(lang)
+            if lang_bucket is None:
+                lang_bucket = self._lang_buckets[lang] = TokenBucket(settings.AI_LANG_POSTS_PER_HOUR)
+            wait = lang_bucket.wait_time(now)
+
+            state = None
+            if kind in AUTONOMOUS and thread_id is not None:
+                state = self._thread_state(thread_id)
+                bucket, last_at = state
+                cooldown = 0.0 if last_at is None else last_at + settings.AI_REPLY_COOLDOWN_SECONDS - now
+                wait = max(wait, cooldown, bucket.wait_time(now))
+
+            if wait > 0:
+                return Admission(False, retry_after=wait, reason=f"rate limited ({lang}, thread {thread_id})")
+
+            lang_bucket.take()
+            if state is not None:
+                state[0].take()
+                state[1] = now
+
+        max_personas = None
+        if backlog >= settings.AI_SHED_DEGRADE_DEPTH or self.saturated():
+            max_personas = 1
+        return Admission(True, max_personas=max_personas)
+
+    def _thread_state(self, thread_id: int) -> list:
+        state = self._threads.get(thread_id)
+        if state is None:
+            state = self._threads[thread_id] = [TokenBucket(settings.AI_POSTS_PER_HOUR), None]
+            while len(self._threads) > THREAD_BUCKETS_MAX:
+                self._threads.popitem(last=False)
+        self._threads.move_to_end(thread_id)
+        return state
+
+    # --- backend concurrency -----------------------------------------------
+
+    def _backend(self, base_url: str) -> _Backend:
+        with self._lock:
+            backend = self._backends.get(base_url)
+            if backend is None:
+                backend = self._backends[base_url] = _Backend(max(1, settings.AI_FANOUT_CONCURRENCY))
+            return backend
+
+    @asynccontextmanager
+    async def backend_slot(self, base_url: str):
+        """Holds one of the backend's AI_FANOUT_CONCURRENCY slots for the duration of a model call."""
+        backend = self._backend(base_url)
+        with self._lock:
+            backend.waiting += 1
+        try:
+            await backend.sem.acquire()
+        finally:
+            with self._lock:
+                backend.waiting -= 1
+        with self._lock:
+            backend.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                backend.active -= 1
+            backend.sem.release()
+
+    def saturated(self) -> bool:
+        """True when any backend has requests queued behind its concurrency cap."""
+        with self._lock:
+            return any(b.waiting > 0 for b in self._backends.values())
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return {url: {"active": b.active, "waiting": b.waiting} for url, b in self._backends.items()}
+
+
+# Singleton instance
+admission = AdmissionController()
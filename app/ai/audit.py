@@ -1,9 +1,8 @@
 ﻿import json
 import hashlib
 from datetime import datetime
-from sqlmodel import Session
-from app.db import engine
 from app.models import AIAuditLog
+from app.event_writer import event_writer, AUDIT_DURABILITY
 
 def sanitize_payload(payload: dict) -> str:
     # Minimal sanitization - in real app, remove PII
@@ -25,7 +24,9 @@ def log_event(
 ):
     """
     Writes an audit log entry to the DB.
-    Forcefully committed to ensure trace even if action fails later.
+    AUDIT_DURABILITY=strict commits it before returning, so the trace exists
+    even if the action fails later; batched (default) commits it with the
+    next event writer flush (within EVENT_FLUSH_MS) and never drops it.
     """
     raw_payload = sanitize_payload(payload) if payload else None
     input_h = compute_input_hash(content_to_hash) if content_to_hash else None
@@ -41,13 +42,10 @@ def log_event(
         raw_payload=raw_payload
     )
 
-    try:
-        with Session(engine) as session:
-            session.add(log_entry)
-            session.commit()
-    except Exception as e:
-        print(f"FAILED TO WRITE AUDIT LOG: {e}")
-        # Fallback to file system if DB fails? 
-        # For now, print to stderr is enough for MVP.
+    if AUDIT_DURABILITY == "strict":
+        if not event_writer.write_now(log_entry):
+            print(f"FAILED TO WRITE AUDIT LOG: {event_type} {target_id}")
+    else:
+        event_writer.add(log_entry, durable=True)
 
 
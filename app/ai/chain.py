@@ -1,38 +1,140 @@
-﻿import random
+﻿import os
+import random
 import uuid
-import asyncio
-from sqlmodel import select, Session
+from sqlmodel import Session
 from app.db import engine
 from app.models import Post
-from app.ai.multi_reply import generate_multi_replies
+from app.ai.multi_reply import generate_multi_replies_async
+from app.ai.stream import stream_hub, token_sink
+from app.ai.context import recent_context, note_post
+from app.ai.config import settings
 from app.chain_safety import safe_chain
+from app.summary import bump_summary
+from app.job_queue import job_queue, RetryLater, PRIORITY_HUMAN, PRIORITY_CHAIN
+from app.ai.admission import admission, HUMAN, CHAIN
+from app.logging import log_error, log_info
 
-async def maybe_ai_chain(thread_id: int, parent_post_id: int, lang: str = "jp", gen_id: str = None, depth: int = 0):
+# Pause between chain steps (a delayed job, not a sleeping task)
+CHAIN_STEP_DELAY_SECONDS = float(os.getenv("CHAIN_STEP_DELAY_SECONDS", "2"))
+
+def _live_sink(thread_id: int, reply_to_id: int, gen_key: str):
+    # Always stream when enabled: the page usually subscribes after generation has started
+    if settings.AI_STREAM_ENABLED:
+        return token_sink(thread_id, reply_to_id, gen_key)
+    return None
+
+def _publish_done(thread_id: int, gen_key: str, post_ids: list):
+    stream_hub.publish(thread_id, {"type": "done", "key": gen_key, "post_ids": post_ids})
+
+def queue_ai_replies(thread_id: int, user_post_id: int, content: str, lang: str, context: str, mode: str, persona: str = "") -> int:
+    """Queues attach_ai_replies for a human post; runs ahead of chains and scheduled work."""
+    payload = {
+        "thread_id": thread_id, "user_post_id": user_post_id, "content": content,
+        "lang": lang, "context": context, "mode": mode, "persona": persona,
+    }
+    return job_queue.enqueue("ai_reply", payload, priority=PRIORITY_HUMAN)
+
+@job_queue.handler("ai_reply")
+async def attach_ai_replies(thread_id: int, user_post_id: int, content: str, lang: str, context: str, mode: str, persona: str = ""):
+    """
+    Generates AI replies to a committed human post and attaches them to the thread.
+    mode: "specific" (ai_persona), "multi" (ai_multi=1) or "single" (ai=1)
+    """
+    decision = admission.admit(HUMAN, lang, thread_id)
+    if not decision.admitted:
+        raise RetryLater(decision.retry_after, decision.reason)
+
+    gen_key = f"reply-{user_post_id}"
+    on_token = _live_sink(thread_id, user_post_id, gen_key)
+    try:
+        if mode == "specific":
+            replies = (await generate_multi_replies_async(content, lang=lang, context=context, specific_persona=persona, on_token=on_token))[:1]
+        elif mode == "multi":
+            replies = await generate_multi_replies_async(content, lang=lang, context=context, on_token=on_token, max_personas=decision.max_personas)
+        else:
+            replies = (await generate_multi_replies_async(content, lang=lang, context=context, on_token=on_token))[:1]
+            for r in replies:
+                r["name"] = "Assistant"
+
+        if not replies:
+            _publish_done(thread_id, gen_key, [])
+            return
+
+        with Session(engine) as session:
+            ai_posts_created = []
+            for r in replies:
+                p = Post(
+                    language=lang,
+                    name=r["name"],
+                    persona=r["name"],
+                    content=r["content"],
+                    is_ai=True,
+                    reply_to_id=user_post_id,
+                    thread_id=thread_id,
+                    depth=1
+                )
+                session.add(p)
+                bump_summary(session, thread_id, p)
+                ai_posts_created.append(p)
+            session.commit()
+            for p in ai_posts_created:
+                note_post(p)
+
+            # Chain off the latest AI reply
+            post_ids = [p.id for p in ai_posts_created]
+            latest_ai = ai_posts_created[-1]
+            latest_id, latest_depth = latest_ai.id, latest_ai.depth
+    except Exception as e:
+        log_error(f"AI reply task failed (thread {thread_id}): {e}")
+        _publish_done(thread_id, gen_key, [])
+        raise  # the job queue retries with backoff
+
+    _publish_done(thread_id, gen_key, post_ids)
+    maybe_ai_chain(thread_id, latest_id, lang, depth=latest_depth)
+
+def maybe_ai_chain(thread_id: int, parent_post_id: int, lang: str = "jp", gen_id: str = None, depth: int = 0, delay: float = 0.0):
+    """Rolls for a follow-up AI reply to parent_post_id and queues it. Returns the job id or None."""
     if not safe_chain(depth):
-        return
+        return None
 
     if random.random() > 0.3:
-        return
+        return None
 
     if not gen_id:
         gen_id = str(uuid.uuid4())
 
+    payload = {"thread_id": thread_id, "parent_post_id": parent_post_id, "lang": lang, "gen_id": gen_id, "depth": depth}
+    return job_queue.enqueue("ai_chain", payload, priority=PRIORITY_CHAIN, delay=delay)
+
+@job_queue.handler("ai_chain")
+async def ai_chain_step(thread_id: int, parent_post_id: int, lang: str, gen_id: str, depth: int):
+    decision = admission.admit(CHAIN, lang, thread_id)
+    if not decision.admitted:
+        if decision.retry_after:
+            raise RetryLater(decision.retry_after, decision.reason)
+        log_info(f"AI chain skipped (thread {thread_id}): {decision.reason}")
+        return
+
     with Session(engine) as session:
         parent = session.get(Post, parent_post_id)
         if not parent:
             return
-        
-        recent = session.exec(select(Post).where(Post.thread_id == thread_id).order_by(Post.created_at.desc())).all()[:6]
-        recent = list(reversed(recent))
-        context = "\n".join([f"{p.name}: {p.content}" for p in recent if p.content])
+        parent_content = parent.content
 
-        replies = generate_multi_replies(parent.content, lang=lang, context=context)
-        
-        if not replies:
-            return
+        context = recent_context(session, thread_id, limit=6)
 
-        r = replies[0]
+    # Generate outside the session: the model call runs on the worker pool
+    gen_key = f"chain-{parent_post_id}"
+    on_token = _live_sink(thread_id, parent_post_id, gen_key)
+    replies = await generate_multi_replies_async(parent_content, lang=lang, context=context, on_token=on_token)
 
+    if not replies:
+        _publish_done(thread_id, gen_key, [])
+        return
+
+    r = replies[0]
+
+    with Session(engine) as session:
         ai_post = Post(
             language=lang,
             name=r["name"],
@@ -45,8 +147,12 @@ async def maybe_ai_chain(thread_id: int, parent_post_id: int, lang: str = "jp",
             depth=depth+1
         )
         session.add(ai_post)
+        bump_summary(session, thread_id, ai_post)
         session.commit()
         session.refresh(ai_post)
-        
-        await asyncio.sleep(2)
-        await maybe_ai_chain(thread_id, ai_post.id, lang, gen_id, depth+1)
+        note_post(ai_post)
+        ai_post_id = ai_post.id
+
+    _publish_done(thread_id, gen_key, [ai_post_id])
+
+    maybe_ai_chain(thread_id, ai_post_id, lang, gen_id, depth+1, delay=CHAIN_STEP_DELAY_SECONDS)
@@ -0,0 +1,158 @@
+"""
+Content-addressed cache for model completions.
+
+The key is a hash of model, options and prompt (or chat messages). Only
+deterministic requests are cached, i.e. a fixed seed or temperature 0;
+sampling without a seed is meant to give fresh text and bypasses the cache.
+
+Tier 1 is an in-process LRU. Tier 2, enabled by AI_CACHE_DB_PATH, is its own
+SQLite file, so hits survive restarts without adding writes to the board DB.
+Both tiers expire entries after AI_CACHE_TTL_SECONDS and are capped in size.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app import metrics
+from app.ai.config import settings
+from app.logging import log_error
+
+# Expired / surplus rows in the SQLite tier are pruned every N writes
+DB_PRUNE_EVERY = 100
+
+metrics.describe("llm_cache_requests_total", "counter", "LLM completion cache lookups by result")
+metrics.describe("llm_cache_entries", "gauge", "Entries held per LLM completion cache tier")
+
+
+def cache_key(model: str, options: Dict[str, Any], prompt: Any) -> Optional[str]:
+    """None when the request samples without a fixed seed (not cacheable)."""
+    if not settings.AI_CACHE_ENABLED:
+        return None
+    if options.get("seed") is None and options.get("temperature", 0) != 0:
+        metrics.inc("llm_cache_requests_total", result="bypass")
+        return None
+    raw = json.dumps({"model": model, "options": options, "prompt": prompt}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    def __init__(self, path: str, max_rows: int):
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completion ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_completion_expires_at ON completion (expires_at)")
+        self._conn.commit()
+
+    def get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM completion WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completion (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            self._writes += 1
+            if self._writes % DB_PRUNE_EVERY == 0:
+                self._prune(time.time())
+            self._conn.commit()
+
+    def _prune(self, now: float):
+        self._conn.execute("DELETE FROM completion WHERE expires_at <= ?", (now,))
+        # Size cap: drop the entries closest to expiry (the oldest writes)
+        self._conn.execute(
+            "DELETE FROM completion WHERE key IN ("
+            " SELECT key FROM completion ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM completion").fetchone()[0]
+
+
+class CompletionCache:
+    def __init__(self, max_entries: int, ttl_s: float, db_path: str = "", db_max_rows: int = 0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        # key -> (text, expires_at), least recently used first
+        self._mem: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._disk: Optional[_DiskTier] = None
+        if db_path:
+            try:
+                self._disk = _DiskTier(db_path, db_max_rows)
+            except sqlite3.Error as e:
+                log_error(f"LLM cache: SQLite tier disabled ({e})")
+        metrics.register_collector(self._collect)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if item[1] > now:
+                    self._mem.move_to_end(key)
+                    metrics.inc("llm_cache_requests_total", result="hit_memory")
+                    return item[0]
+                del self._mem[key]
+
+        if self._disk is not None:
+            try:
+                item = self._disk.get(key, now)
+            except sqlite3.Error as e:
+                log_error(f"LLM cache read failed: {e}")
+                item = None
+            if item is not None:
+                self._remember(key, *item)
+                metrics.inc("llm_cache_requests_total", result="hit_disk")
+                return item[0]
+
+        metrics.inc("llm_cache_requests_total", result="miss")
+        return None
+
+    def put(self, key: str, text: str):
+        expires_at = time.time() + self.ttl_s
+        self._remember(key, text, expires_at)
+        if self._disk is not None:
+            try:
+                self._disk.put(key, text, expires_at)
+            except sqlite3.Error as e:
+                log_error(f"LLM cache write failed: {e}")
+
+    def _remember(self, key: str, text: str, expires_at: float):
+        with self._lock:
+            self._mem[key] = (text, expires_at)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def _collect(self):
+        with self._lock:
+            in_memory = len(self._mem)
+        yield "llm_cache_entries", in_memory, {"tier": "memory"}
+        if self._disk is not None:
+            yield "llm_cache_entries", self._disk.count(), {"tier": "sqlite"}
+
+
+# Singleton instance
+completion_cache = CompletionCache(
+    max_entries=settings.AI_CACHE_ENTRIES,
+    ttl_s=settings.AI_CACHE_TTL_SECONDS,
+    db_path=settings.AI_CACHE_DB_PATH,
+    db_max_rows=settings.AI_CACHE_DB_MAX_ROWS,
+)
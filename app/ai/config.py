@@ -1,19 +1,46 @@
 ﻿import os
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings
 
 class AISettings(BaseSettings):
     AI_ENABLED: bool = False
-    AI_PROVIDER: str = "openai" # openai, ollama
-    AI_MODEL: str = "gpt-3.5-turbo"
-    AI_API_KEY: str = ""
+    AI_PROVIDER: str = "ollama" # ollama, mock (canned replies, no model)
     AI_KILL_SWITCH: bool = False
     
     # Ratelimits & Thresholds
-    AI_POSTS_PER_HOUR: int = 2
-    AI_REPLY_COOLDOWN_SECONDS: int = 600
+    AI_POSTS_PER_HOUR: int = 2 # autonomous (chain / scheduled) AI posts per thread
+    AI_REPLY_COOLDOWN_SECONDS: int = 600 # min gap between autonomous AI posts in a thread
+    AI_LANG_POSTS_PER_HOUR: int = 120 # all AI generations per language
     AI_SUMMARY_THRESHOLD_POSTS: int = 20
     AI_FLAG_THRESHOLD: float = 0.80
 
+    # Generation pipeline
+    AI_FANOUT_ENABLED: bool = True # issue all persona prompts at once
+    AI_FANOUT_CONCURRENCY: int = 4 # max in-flight generations per Ollama backend
+    AI_PERSONA_TIMEOUT_SECONDS: float = 45.0
+    AI_STREAM_ENABLED: bool = True # stream tokens to open thread pages over SSE
+
+    # Prompt budget (estimated tokens, generation not included)
+    AI_PROMPT_TOKEN_BUDGET: int = 2048
+    AI_PROMPT_TOKEN_BUDGETS: Dict[str, int] = {} # per-model overrides, JSON: {"llama3.1:8b": 4096}
+
+    # Completion cache (deterministic requests only: fixed seed or temperature 0)
+    AI_SEED: Optional[int] = None # fixed sampling seed; makes persona replies cacheable
+    AI_CACHE_ENABLED: bool = True
+    AI_CACHE_ENTRIES: int = 1024 # in-memory LRU tier
+    AI_CACHE_TTL_SECONDS: float = 3600.0
+    AI_CACHE_DB_PATH: str = "" # optional SQLite tier, e.g. "llm_cache.sqlite3"
+    AI_CACHE_DB_MAX_ROWS: int = 50000
+
+    # Provider chain: Ollama nodes (OLLAMA_URL, then OLLAMA_FALLBACK_URLS), then the mock
+    AI_FALLBACK_MOCK: bool = True # answer with canned replies when every node is down
+    AI_BREAKER_FAILURES: int = 3 # consecutive failures before a provider is skipped
+    AI_BREAKER_RESET_SECONDS: float = 30.0 # how long it is skipped before one trial request
+
+    # Load shedding on the job queue backlog
+    AI_SHED_DEGRADE_DEPTH: int = 4 # multi replies drop to one persona
+    AI_SHED_SKIP_DEPTH: int = 12 # chains and scheduled threads are skipped
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
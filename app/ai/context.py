@@ -0,0 +1,63 @@
+﻿import os
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Tuple
+from sqlmodel import select
+from app.models import Post
+
+# Longest window any caller asks for, and how many threads to keep warm.
+# The prompt builder trims this window further to the model's token budget.
+CONTEXT_MAX_POSTS = int(os.getenv("CONTEXT_MAX_POSTS", "20"))
+CONTEXT_CACHE_THREADS = int(os.getenv("CONTEXT_CACHE_THREADS", "1000"))
+
+_lock = threading.Lock()
+# thread_id -> (post id, rendered line) of the newest posts, oldest first
+_cache: "OrderedDict[int, Deque[Tuple[int, str]]]" = OrderedDict()
+
+def _line(name: str, is_ai: bool, content: str) -> str:
+    return f"{('AI-' if is_ai else '')}{name}: {content}"
+
+def _load(session, thread_id: int) -> Deque[Tuple[int, str]]:
+    # LIMIT in SQL and only the columns the prompt needs; hidden posts never
+    # reach a prompt, which is what invalidate() after an admin hide relies on
+    rows = session.exec(
+        select(Post.id, Post.name, Post.is_ai, Post.content)
+        .where(Post.thread_id == thread_id)
+        .where(Post.is_hidden == False)  # noqa: E712
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(CONTEXT_MAX_POSTS)
+    ).all()
+    return deque(((i, _line(n, a, c)) for i, n, a, c in reversed(rows) if c), maxlen=CONTEXT_MAX_POSTS)
+
+def recent_context(session, thread_id: int, limit: int = CONTEXT_MAX_POSTS) -> str:
+    """
+    Last `limit` posts of the thread as "name: content" lines, oldest first.
+    Served from the per-thread cache; the DB is only read on a cold thread.
+    """
+    # Cold loads happen under the lock so a concurrent note_post() cannot slip
+    # between the SELECT and the cache fill; the query is a tiny index scan.
+    with _lock:
+        entries = _cache.get(thread_id)
+        if entries is None:
+            entries = _load(session, thread_id)
+            _cache[thread_id] = entries
+            while len(_cache) > CONTEXT_CACHE_THREADS:
+                _cache.popitem(last=False)
+        _cache.move_to_end(thread_id)
+        lines = [line for _, line in entries][-limit:]
+
+    return "\n".join(lines)
+
+def note_post(post: Post):
+    """Call after a post is committed: appends it to the cached window of its thread."""
+    if not post.content or post.thread_id is None:
+        return
+    with _lock:
+        entries = _cache.get(post.thread_id)
+        # Skip posts the cold load already picked up
+        if entries is not None and (not entries or post.id > entries[-1][0]):
+            entries.append((post.id, _line(post.name, post.is_ai, post.content)))
+
+def invalidate(thread_id: int):
+    with _lock:
+        _cache.pop(thread_id, None)
@@ -1,12 +1,16 @@
-﻿import os
-import random
+﻿import random
 import time
-from typing import List, Dict
-import httpx
-import yaml
-from sqlmodel import Session
-from app.db import engine
+import asyncio
+from functools import partial
+from typing import Callable, List, Dict, Optional, Tuple
 from app.models import AIEvent
+from app.event_writer import event_writer
+from app.ai.config import settings as ai_settings
+from app.ai.personas import persona_registry, make_persona, board_rules
+from app.ai.prompt import build_shared, estimate_tokens
+from app.ai.provider import llm
+from app.http_pool import run_sync
+from app.ollama_client import Message
 # FIX: Adjusted import to absolute path for stability, removed unused loggers
 from app.logging import log_info, log_error
 
@@ -22,49 +26,57 @@ def safe_log(event, **kwargs):
     except:
         pass
 
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
-
-BASE_DIR = os.path.dirname(__file__)
-JP_PATH = os.path.join(BASE_DIR, "personas_jp.yaml")
-EN_PATH = os.path.join(BASE_DIR, "personas_en.yaml")
-
-def _load_yaml(path: str) -> Dict:
-    with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f) or {}
-
-def _ollama(prompt: str, temperature: float, num_predict: int) -> str:
-    payload = {
-        "model": OLLAMA_MODEL,
-        "prompt": prompt,
-        "stream": False,
-        "options": {"temperature": temperature, "num_predict": num_predict},
-    }
+# on_token(persona_index, persona_name, chunk)
+TokenCallback = Callable[[int, str, str], None]
+
+async def _stream(messages: List[Message], temperature: float, num_predict: int, on_token: Callable[[str], None]) -> str:
+    parts = []
+    async for chunk in llm.stream(messages, temperature=temperature, num_predict=num_predict, seed=ai_settings.AI_SEED):
+        parts.append(chunk)
+        on_token(chunk)
+    return "".join(parts).strip()
+
+async def _timed_reply(messages: List[Message], temperature: float, num_predict: int, on_token: Optional[Callable[[str], None]] = None) -> Tuple[Optional[str], int, Optional[Exception]]:
+    """
+    Runs one persona generation through the provider chain (app.ai.provider).
+    Returns (text, latency_ms, error) instead of raising so fan-out can collect partial results.
+    """
+    timeout_s = ai_settings.AI_PERSONA_TIMEOUT_SECONDS
+    t0 = time.monotonic()
     try:
-        with httpx.Client(timeout=30.0) as client:
-            r = client.post(f"{OLLAMA_URL}/api/generate", json=payload)
-            r.raise_for_status()
-            return (r.json().get("response") or "").strip()
+        if on_token is None:
+            completion = await asyncio.wait_for(
+                llm.chat(messages, temperature=temperature, num_predict=num_predict, seed=ai_settings.AI_SEED), timeout_s
+            )
+            text = completion.text
+        else:
+            text = await asyncio.wait_for(_stream(messages, temperature, num_predict, on_token), timeout_s)
+    except asyncio.TimeoutError:
+        return None, int((time.monotonic() - t0) * 1000), TimeoutError(f"persona timed out after {timeout_s}s")
     except Exception as e:
-        log_error(f"Ollama Error: {e}")
-        raise e
-
-def _generate_core(user_text: str, lang: str, context: str = "", specific_persona: str = "") -> List[Dict[str, str]]:
+        return None, int((time.monotonic() - t0) * 1000), e
+    return text, int((time.monotonic() - t0) * 1000), None
+
+async def _generate_core(user_text: str, lang: str, context: str = "", specific_persona: str = "", on_token: Optional[TokenCallback] = None, max_personas: Optional[int] = None) -> List[Dict[str, str]]:
+    """
+    on_token(index, persona_name, chunk), if given, switches every persona to
+    streaming mode and receives each chunk as it arrives.
+    max_personas caps the fan-out below the config's max_replies (load shedding).
+    """
     start_time = time.time()
     user_text = (user_text or "").strip()
     if not user_text:
         return [{"name": "Anon" if lang == "en" else "風吹けば名無し", "content": "(empty)"}]
 
-    cfg = _load_yaml(EN_PATH if lang == "en" else JP_PATH)
-    personas = cfg.get("personas", [])
-    settings = cfg.get("settings", {})
-    max_replies = int(settings.get("max_replies", 3))
-    temperature = float(settings.get("temperature", 0.8))
-    num_predict = int(settings.get("num_predict", 180))
+    cfg = persona_registry.get(lang)
+    personas = list(cfg.personas)
+    max_replies = cfg.max_replies if max_personas is None else min(cfg.max_replies, max_personas)
+    temperature = cfg.temperature
+    num_predict = cfg.num_predict
 
     picked = []
     if specific_persona:
-        found = next((p for p in personas if p["name"] == specific_persona), None)
+        found = cfg.find(specific_persona)
         if found:
             picked = [found]
         else:
@@ -72,77 +84,72 @@ def _generate_core(user_text: str, lang: str, context: str = "", specific_person
             picked = personas[:1]
     else:
         random.shuffle(personas)
-        picked = personas[:max_replies] if personas else [{"name": "Anon", "role": "short reply"}]
+        picked = personas[:max_replies] if personas else [make_persona(lang, "Anon", "short reply")]
 
     # If specific_persona is set, we usually want just 1 reply (redundant check but safe)
     if specific_persona:
         picked = picked[:1]
 
+    # Board rules, context and post form one shared prefix, budgeted once;
+    # each persona's messages differ only in the trailing role line
+    persona_tokens = max((estimate_tokens(p.instructions) for p in picked), default=0)
+    shared = build_shared(context, user_text, llm.model, persona_tokens, system=board_rules(lang))
+    jobs = []
+    for p in picked:
+        shared.record(p.instructions)
+        jobs.append((p.name, shared.for_persona(p.instructions)))
+
+    # Fan out: all persona prompts are in flight at once (capped per backend),
+    # so wall-clock latency tracks the slowest persona instead of the sum.
+    calls = [
+        _timed_reply(messages, temperature, num_predict, _persona_sink(on_token, i, pname))
+        for i, (pname, messages) in enumerate(jobs)
+    ]
+    if ai_settings.AI_FANOUT_ENABLED and len(calls) > 1:
+        outcomes = await asyncio.gather(*calls)
+    else:
+        outcomes = [await call for call in calls]
+
+    # AIEvent rows go through the buffered writer: no commit per persona
     replies = []
-    with Session(engine) as session:
-        for p in picked:
-            pname = p.get("name", "Anon" if lang == "en" else "名無し")
-            role = p.get("role", "")
-
-            if lang == "en":
-                system = f"""You are an anonymous message board user.
-Write in English only. Short 1-3 lines. Internet-forum vibe. No hate, no harassment, no illegal instructions, no personal data requests.
-Your role: {role}
-"""
-            else:
-                system = f"""あなたは匿名掲示板の住人。
-日本語のみ。短文1〜3行。2chっぽい空気。ただし差別/誹謗中傷/違法助言/個人情報の要求は禁止。
-あなたの役割: {role}
-"""
-
-            prompt = f"""{system}
-
-(THREAD CONTEXT)
-{context}
-
-(POST)
-{user_text}
-
-REPLY:
-"""
-            # Logging Event Setup
-            event = AIEvent(
-                mode="specific" if specific_persona else "multi",
-                persona=pname,
-                ok=False
-            )
-            
-            try:
-                t0 = time.time()
-                text = _ollama(prompt, temperature=temperature, num_predict=num_predict)
-                latency = int((time.time() - t0) * 1000)
-                
-                if not text:
-                    text = "草" if lang != "en" else "lol"
-                
-                event.ok = True
-                event.latency_ms = latency
-                log_info(f"AI Success: {pname} ({latency}ms)")
-                
-            except Exception as e:
-                text = f"(AI error: {type(e).__name__})" if lang == "en" else f"（AIエラー: {type(e).__name__}）"
-                event.error = str(e)
-                event.ok = False
-                log_error(f"AI Failed: {pname} - {e}")
-
-            session.add(event)
-            session.commit()
-
-            text = text.strip()[:500]
-            replies.append({"name": pname, "content": text})
+    for (pname, _), (text, latency, err) in zip(jobs, outcomes):
+        # Logging Event Setup
+        event = AIEvent(
+            mode="specific" if specific_persona else "multi",
+            persona=pname,
+            ok=False
+        )
+
+        if err is None:
+            if not text:
+                text = "草" if lang != "en" else "lol"
+
+            event.ok = True
+            event.latency_ms = latency
+            log_info(f"AI Success: {pname} ({latency}ms)")
+        else:
+            text = f"(AI error: {type(err).__name__})" if lang == "en" else f"（AIエラー: {type(err).__name__}）"
+            event.error = str(err)
+            event.ok = False
+            log_error(f"AI Failed: {pname} - {err}")
+
+        event_writer.add(event)
+
+        text = text.strip()[:500]
+        replies.append({"name": pname, "content": text})
 
     return replies
 
-def generate_multi_replies(user_text: str, lang: str, context: str = "", specific_persona: str = "") -> List[Dict[str, str]]:
+def _persona_sink(on_token: Optional[TokenCallback], index: int, pname: str) -> Optional[Callable[[str], None]]:
+    if on_token is None:
+        return None
+    return partial(on_token, index, pname)
+
+async def generate_multi_replies_async(user_text: str, lang: str, context: str = "", specific_persona: str = "", on_token: Optional[TokenCallback] = None, max_personas: Optional[int] = None) -> List[Dict[str, str]]:
     try:
         log_info("AI multi reply generation started")
 
-        replies = _generate_core(user_text, lang, context, specific_persona)
+        replies = await _generate_core(user_text, lang, context, specific_persona, on_token=on_token, max_personas=max_personas)
 
         log_info(f"AI replies generated: {len(replies)}")
         safe_log("multi_reply_success", count=len(replies))
@@ -154,3 +161,7 @@ def generate_multi_replies(user_text: str, lang: str, context: str = "", specifi
         safe_log("multi_reply_error", error=str(e))
         return []
 
+
+def generate_multi_replies(user_text: str, lang: str, context: str = "", specific_persona: str = "", on_token: Optional[TokenCallback] = None, max_personas: Optional[int] = None) -> List[Dict[str, str]]:
+    """Blocking wrapper for scripts; code on the event loop awaits generate_multi_replies_async."""
+    return run_sync(generate_multi_replies_async(user_text, lang, context, specific_persona, on_token, max_personas))
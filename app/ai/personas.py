@@ -0,0 +1,115 @@
+﻿import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+import yaml
+
+BASE_DIR = os.path.dirname(__file__)
+PERSONA_PATHS = {
+    "jp": os.path.join(BASE_DIR, "personas_jp.yaml"),
+    "en": os.path.join(BASE_DIR, "personas_en.yaml"),
+}
+
+# Board rules are the same for every persona of a language (stable prompt
+# prefix); the role line is the persona-specific part.
+BOARD_RULES = {
+    "en": """You are an anonymous message board user.
+Write in English only. Short 1-3 lines. Internet-forum vibe. No hate, no harassment, no illegal instructions, no personal data requests.
+""",
+    "jp": """あなたは匿名掲示板の住人。
+日本語のみ。短文1〜3行。2chっぽい空気。ただし差別/誹謗中傷/違法助言/個人情報の要求は禁止。
+""",
+}
+
+ROLE_TEMPLATES = {
+    "en": "Your role: {role}\n",
+    "jp": "あなたの役割: {role}\n",
+}
+
+SYSTEM_TEMPLATES = {lang: BOARD_RULES[lang] + ROLE_TEMPLATES[lang] for lang in BOARD_RULES}
+
+@dataclass(frozen=True)
+class Persona:
+    name: str
+    role: str
+    label: str          # short description shown in the persona <select>
+    system_prompt: str  # pre-built from SYSTEM_TEMPLATES
+    instructions: str   # role line only (ROLE_TEMPLATES), sent after the shared prefix
+
+@dataclass(frozen=True)
+class PersonaConfig:
+    lang: str
+    personas: Tuple[Persona, ...]
+    max_replies: int
+    temperature: float
+    num_predict: int
+    mtime: float
+
+    def find(self, name: str) -> Optional[Persona]:
+        return next((p for p in self.personas if p.name == name), None)
+
+def board_rules(lang: str) -> str:
+    return BOARD_RULES["en" if lang == "en" else "jp"]
+
+def make_persona(lang: str, name: str, role: str = "", label: str = "") -> Persona:
+    lang = "en" if lang == "en" else "jp"
+    return Persona(
+        name=name,
+        role=role,
+        label=label,
+        system_prompt=SYSTEM_TEMPLATES[lang].format(role=role),
+        instructions=ROLE_TEMPLATES[lang].format(role=role),
+    )
+
+def _parse(lang: str, path: str) -> PersonaConfig:
+    mtime = os.stat(path).st_mtime
+    with open(path, "r", encoding="utf-8") as f:
+        raw = yaml.safe_load(f) or {}
+    settings = raw.get("settings", {})
+    personas = tuple(
+        make_persona(lang, p.get("name", "Anon" if lang == "en" else "名無し"), p.get("role", ""), p.get("label", ""))
+        for p in raw.get("personas", [])
+    )
+    return PersonaConfig(
+        lang=lang,
+        personas=personas,
+        max_replies=int(settings.get("max_replies", 3)),
+        temperature=float(settings.get("temperature", 0.8)),
+        num_predict=int(settings.get("num_predict", 180)),
+        mtime=mtime,
+    )
+
+class PersonaRegistry:
+    """
+    Immutable persona configs keyed by language, parsed once and re-parsed
+    only when the YAML file's mtime changes (or on reload()).
+    """
+
+    def __init__(self, paths: Dict[str, str] = None):
+        self.paths = paths or PERSONA_PATHS
+        self._configs: Dict[str, PersonaConfig] = {}
+        self._lock = threading.Lock()
+
+    def get(self, lang: str) -> PersonaConfig:
+        lang = "en" if lang == "en" else "jp"
+        cfg = self._configs.get(lang)
+        try:
+            stale = cfg is None or os.stat(self.paths[lang]).st_mtime != cfg.mtime
+        except OSError:
+            # File vanished mid-edit: keep serving what we have
+            stale = cfg is None
+        if stale:
+            with self._lock:
+                cfg = _parse(lang, self.paths[lang])
+                self._configs[lang] = cfg
+        return cfg
+
+    def reload(self) -> Dict[str, int]:
+        """Force re-parse of every language. Returns persona counts."""
+        with self._lock:
+            for lang, path in self.paths.items():
+                self._configs[lang] = _parse(lang, path)
+            return {lang: len(cfg.personas) for lang, cfg in self._configs.items()}
+
+# Singleton instance
+persona_registry = PersonaRegistry()
@@ -0,0 +1,106 @@
+"""
+Prompt assembly under a token budget.
+
+Token counts are estimates, with no tokenizer dependency: CJK characters
+count as one token each, other text as one token per ~4 characters. That is
+close enough to keep prompts inside the budget; Ollama's real
+prompt_eval_count is recorded next to the estimate in metrics.
+
+Layout (chat messages): what every persona shares comes first (board rules
+as the system message, then thread context and the post) and the persona
+instructions last. The shared part is built and budgeted once per post, and
+since every persona's request starts with the same tokens, Ollama can reuse
+the evaluated prefix (KV cache) across the personas of a fan-out instead of
+re-reading the thread for each one.
+"""
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from app import metrics
+from app.ai.config import settings
+
+# Hiragana, katakana, CJK ideographs, full-width forms
+_CJK = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+metrics.describe("llm_prompt_tokens_total", "counter", "Estimated tokens of the prompts built, by prompt part")
+metrics.describe("llm_prompts_total", "counter", "Prompts built for the model (completion cache hits included)")
+metrics.describe("llm_prompt_eval_tokens_total", "counter", "Prompt tokens the model reports having evaluated")
+metrics.describe("llm_prompt_eval_seconds_total", "counter", "Time the model reports spending on prompt evaluation")
+metrics.describe("llm_context_lines_dropped_total", "counter", "Thread context lines left out to fit the token budget")
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def prompt_budget(model: str) -> int:
+    """Prompt tokens allowed for one request to `model` (generation not included)."""
+    return settings.AI_PROMPT_TOKEN_BUDGETS.get(model, settings.AI_PROMPT_TOKEN_BUDGET)
+
+
+def fit_lines(lines: List[str], budget: int) -> Tuple[List[str], int]:
+    """Keeps the newest lines that fit in `budget` tokens. Returns (lines oldest first, tokens)."""
+    kept, used = [], 0
+    for line in reversed(lines):
+        cost = estimate_tokens(line) + 1  # + newline
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    kept.reverse()
+    return kept, used
+
+
+def _truncate(text: str, budget: int) -> str:
+    tokens = estimate_tokens(text)
+    if tokens <= budget:
+        return text
+    return text[: max(1, len(text) * budget // tokens)]
+
+
+@dataclass(frozen=True)
+class SharedPrompt:
+    system: str
+    text: str
+    tokens: int
+
+    def for_persona(self, instructions: str) -> List[Dict[str, str]]:
+        """Chat messages: identical for every persona up to `instructions`."""
+        messages = [{"role": "system", "content": self.system}] if self.system else []
+        messages.append({"role": "user", "content": f"{self.text}\n{instructions}REPLY:"})
+        return messages
+
+    def record(self, instructions: str):
+        """Counts one request built from this prefix."""
+        metrics.inc("llm_prompts_total")
+        metrics.inc("llm_prompt_tokens_total", self.tokens, part="shared")
+        metrics.inc("llm_prompt_tokens_total", estimate_tokens(instructions), part="persona")
+
+
+def build_shared(context: str, user_text: str, model: str, persona_tokens: int = 0, system: str = "") -> SharedPrompt:
+    """
+    context: "name: content" lines, oldest first. They are filled newest to
+    oldest into what is left of the model's budget after the system message,
+    the persona instructions (persona_tokens, the longest of the fan-out)
+    and the post.
+    """
+    budget = prompt_budget(model) - persona_tokens - estimate_tokens(system)
+    # A huge post must not starve the context entirely
+    user_text = _truncate(user_text, max(1, budget // 2))
+    lines = context.split("\n") if context else []
+    kept, _ = fit_lines(lines, budget - estimate_tokens(user_text) - 8)
+    if len(kept) < len(lines):
+        metrics.inc("llm_context_lines_dropped_total", len(lines) - len(kept))
+
+    text = f"""(THREAD CONTEXT)
+{chr(10).join(kept)}
+
+(POST)
+{user_text}
+"""
+    return SharedPrompt(system=system, text=text, tokens=estimate_tokens(system) + estimate_tokens(text))
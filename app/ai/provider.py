@@ -0,0 +1,283 @@
+"""
+LLM providers behind one async interface: chat / generate / stream.
+
+Every model call in the app goes through `llm`, an ordered fallback chain:
+the primary Ollama node (OLLAMA_URL), the secondary nodes
+(OLLAMA_FALLBACK_URLS, comma-separated), then the mock when
+AI_FALLBACK_MOCK is on. A request that fails on one provider is retried on
+the next. Each provider has a circuit breaker: after AI_BREAKER_FAILURES
+failures in a row it is skipped for AI_BREAKER_RESET_SECONDS, then a single
+trial request decides whether it is used again.
+
+Deterministic requests are answered from the completion cache before any
+provider is tried; mock answers are never cached. A stream only falls back
+while nothing has been sent to the caller yet.
+"""
+import json
+import os
+import random
+import re
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+from app import metrics
+from app.ai.admission import admission
+from app.ai.completion_cache import cache_key, completion_cache
+from app.ai.config import settings
+from app.logging import log_error
+from app.ollama_client import Message, OllamaClient
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11434")
+OLLAMA_FALLBACK_URLS = [u.strip() for u in os.getenv("OLLAMA_FALLBACK_URLS", "").split(",") if u.strip()]
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
+# Per attempt: short enough that a fallback still fits in AI_PERSONA_TIMEOUT_SECONDS
+OLLAMA_REQUEST_TIMEOUT = float(os.getenv("OLLAMA_REQUEST_TIMEOUT", "30"))
+
+metrics.describe("llm_provider_requests_total", "counter", "LLM requests per provider by result")
+metrics.describe("llm_fallbacks_total", "counter", "LLM requests answered by a provider other than the first")
+metrics.describe("llm_breaker_open", "gauge", "1 while a provider's circuit breaker is open")
+
+_JAPANESE = re.compile(r"[\u3040-\u30ff\u4e00-\u9fff]")
+
+
+class LLMUnavailable(RuntimeError):
+    """Every provider in the chain failed or is skipped by its breaker."""
+
+
+@dataclass(frozen=True)
+class ChatRequest:
+    messages: List[Message]
+    temperature: float = 0.8
+    top_p: float = 0.9
+    num_predict: int = 256
+    seed: Optional[int] = None
+
+    def options(self) -> Dict[str, object]:
+        options: Dict[str, object] = {"temperature": self.temperature, "top_p": self.top_p, "num_predict": self.num_predict}
+        if self.seed is not None:
+            options["seed"] = self.seed
+        return options
+
+
+@dataclass(frozen=True)
+class Completion:
+    text: str
+    provider: str        # name of the provider that answered ("cache" for a cache hit)
+    latency_ms: int = 0
+    mock: bool = False   # canned answer from the last-resort mock
+
+
+class CircuitBreaker:
+    """
+    closed: requests go through. open: skipped until reset_s has passed, then
+    one trial request is let through (half-open); its outcome closes or
+    re-opens the breaker. A trial that never reports back expires after reset_s.
+    """
+
+    def __init__(self, failures: int, reset_s: float):
+        self.max_failures = max(1, failures)
+        self.reset_s = reset_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.trial_at is not None else "open"
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if self.trial_at is not None and now - self.trial_at < self.reset_s:
+            return False
+        if now - self.opened_at < self.reset_s:
+            return False
+        self.trial_at = now
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_at = None
+
+    def failure(self):
+        self.failures += 1
+        self.trial_at = None
+        if self.failures >= self.max_failures:
+            self.opened_at = time.monotonic()
+
+
+class Provider:
+    name = "provider"
+    model = ""
+    mock = False
+
+    async def chat(self, req: ChatRequest) -> str:
+        raise NotImplementedError
+
+    async def stream(self, req: ChatRequest) -> AsyncIterator[str]:
+        # Backends without streaming send the whole reply as one chunk
+        yield await self.chat(req)
+
+
+class OllamaProvider(Provider):
+    def __init__(self, base_url: str, model: str = OLLAMA_MODEL, timeout_s: float = OLLAMA_REQUEST_TIMEOUT):
+        self.name = base_url
+        self.model = model
+        self.base_url = base_url
+        self.client = OllamaClient(base_url=base_url, model=model, timeout_s=timeout_s)
+
+    def _kwargs(self, req: ChatRequest) -> dict:
+        return {"temperature": req.temperature, "top_p": req.top_p, "num_predict": req.num_predict, "seed": req.seed}
+
+    async def chat(self, req: ChatRequest) -> str:
+        async with admission.backend_slot(self.base_url):
+            return await self.client.achat(req.messages, **self._kwargs(req))
+
+    async def stream(self, req: ChatRequest) -> AsyncIterator[str]:
+        async with admission.backend_slot(self.base_url):
+            async for chunk in self.client.achat_stream(req.messages, **self._kwargs(req)):
+                yield chunk
+
+
+class MockProvider(Provider):
+    """Canned answers: keeps the board alive (and dev setups working) without a model."""
+
+    name = "mock"
+    model = "mock"
+    mock = True
+
+    REPLIES = {
+        "en": ["lol", "source?", "based", "this", "fair point tbh"],
+        "jp": ["草", "ソースは？", "それな", "わかる", "ほんまか？"],
+    }
+
+    async def chat(self, req: ChatRequest) -> str:
+        system = " ".join(m["content"] for m in req.messages if m["role"] == "system").lower()
+        user = " ".join(m["content"] for m in req.messages if m["role"] != "system")
+        # JSON-speaking workers (moderation / engagement) get something they can parse
+        if "moderator" in system:
+            if "toxic" in user.lower() or "ban" in user.lower():
+                return json.dumps({"score": 0.9, "reason": "Contains toxic keywords (Mock)", "flag": True})
+            return json.dumps({"score": 0.1, "reason": "Safe content (Mock)", "flag": False})
+        if "resident" in system:
+            return json.dumps({"should_reply": True, "reply_text": "AI Reply: This is interesting!", "confidence": 0.9})
+        return random.choice(self.REPLIES["jp" if _JAPANESE.search(user) else "en"])
+
+
+class LLMRouter:
+    def __init__(self, providers: Sequence[Provider]):
+        self.providers = list(providers)
+        self._breakers = {
+            p.name: CircuitBreaker(settings.AI_BREAKER_FAILURES, settings.AI_BREAKER_RESET_SECONDS)
+            for p in self.providers
+        }
+        metrics.register_collector(self._collect)
+
+    @property
+    def model(self) -> str:
+        return self.providers[0].model
+
+    def _candidates(self):
+        # Lazy: a half-open breaker only hands out its trial when the provider is reached
+        for i, p in enumerate(self.providers):
+            if self._breakers[p.name].allow():
+                yield i, p
+
+    def _succeeded(self, index: int, provider: Provider):
+        self._breakers[provider.name].success()
+        metrics.inc("llm_provider_requests_total", provider=provider.name, result="ok")
+        if index:
+            metrics.inc("llm_fallbacks_total", provider=provider.name)
+
+    def _failed(self, provider: Provider, error: Exception):
+        self._breakers[provider.name].failure()
+        metrics.inc("llm_provider_requests_total", provider=provider.name, result="error")
+        log_error(f"LLM provider {provider.name} failed: {type(error).__name__}: {error}")
+
+    def _cache_key(self, req: ChatRequest) -> Optional[str]:
+        return cache_key(self.model, req.options(), req.messages)
+
+    async def complete(self, req: ChatRequest) -> Completion:
+        key = self._cache_key(req)
+        if key:
+            cached = completion_cache.get(key)
+            if cached is not None:
+                return Completion(cached, "cache")
+
+        last: Optional[Exception] = None
+        for i, p in self._candidates():
+            t0 = time.monotonic()
+            try:
+                text = await p.chat(req)
+            except Exception as e:
+                self._failed(p, e)
+                last = e
+                continue
+            self._succeeded(i, p)
+            if key and text and not p.mock:
+                completion_cache.put(key, text)
+            return Completion(text, p.name, int((time.monotonic() - t0) * 1000), mock=p.mock)
+        raise LLMUnavailable(f"no LLM provider available (last error: {last!r})")
+
+    async def chat(self, messages: List[Message], temperature: float = 0.8, top_p: float = 0.9, num_predict: int = 256, seed: Optional[int] = None) -> Completion:
+        return await self.complete(ChatRequest(list(messages), temperature, top_p, num_predict, seed))
+
+    async def generate(self, prompt: str, system: str = "", temperature: float = 0.8, top_p: float = 0.9, num_predict: int = 256, seed: Optional[int] = None) -> Completion:
+        """Single-turn completion: `prompt` as the user message after an optional system message."""
+        messages = [{"role": "system", "content": system}] if system else []
+        messages.append({"role": "user", "content": prompt})
+        return await self.chat(messages, temperature, top_p, num_predict, seed)
+
+    async def stream(self, messages: List[Message], temperature: float = 0.8, top_p: float = 0.9, num_predict: int = 256, seed: Optional[int] = None) -> AsyncIterator[str]:
+        req = ChatRequest(list(messages), temperature, top_p, num_predict, seed)
+        key = self._cache_key(req)
+        if key:
+            cached = completion_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        last: Optional[Exception] = None
+        for i, p in self._candidates():
+            parts: List[str] = []
+            try:
+                async for chunk in p.stream(req):
+                    parts.append(chunk)
+                    yield chunk
+            except Exception as e:
+                self._failed(p, e)
+                if parts:
+                    raise  # the caller already has part of this reply
+                last = e
+                continue
+            self._succeeded(i, p)
+            text = "".join(parts).strip()
+            if key and text and not p.mock:
+                completion_cache.put(key, text)
+            return
+        raise LLMUnavailable(f"no LLM provider available (last error: {last!r})")
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: {"state": b.state, "failures": b.failures} for name, b in self._breakers.items()}
+
+    def _collect(self):
+        for name, b in self._breakers.items():
+            yield "llm_breaker_open", 1 if b.state != "closed" else 0, {"provider": name}
+
+
+def build_providers() -> List[Provider]:
+    if settings.AI_PROVIDER == "mock":
+        return [MockProvider()]
+    providers: List[Provider] = [OllamaProvider(url) for url in [OLLAMA_URL, *OLLAMA_FALLBACK_URLS]]
+    if settings.AI_FALLBACK_MOCK:
+        providers.append(MockProvider())
+    return providers
+
+
+# Singleton instance
+llm = LLMRouter(build_providers())
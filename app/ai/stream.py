@@ -0,0 +1,91 @@
+﻿import asyncio
+import threading
+from typing import Dict, List, Tuple
+
+# Per-subscriber buffer; a browser that stops reading loses tokens, not the server
+QUEUE_MAX = 1000
+
+class ThreadStreamHub:
+    """
+    In-process pub/sub of live AI generation events, keyed by thread id.
+    Subscribers are SSE handlers on the event loop; publishers may be the
+    generation worker threads, so publish() hands events over thread-safely.
+    """
+
+    def __init__(self):
+        self._subs: Dict[int, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        # Replies still being generated, so late subscribers can catch up
+        self._live: Dict[int, Dict[str, dict]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, thread_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=QUEUE_MAX)
+        with self._lock:
+            for key, item in self._live.get(thread_id, {}).items():
+                _offer(queue, {"type": "start", "key": key, "name": item["name"], "reply_to": item["reply_to"]})
+                if item["text"]:
+                    _offer(queue, {"type": "token", "key": key, "text": item["text"]})
+            self._subs.setdefault(thread_id, []).append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, thread_id: int, queue: asyncio.Queue):
+        with self._lock:
+            subs = [s for s in self._subs.get(thread_id, []) if s[1] is not queue]
+            if subs:
+                self._subs[thread_id] = subs
+            else:
+                self._subs.pop(thread_id, None)
+
+    def publish(self, thread_id: int, event: dict):
+        with self._lock:
+            self._track(thread_id, event)
+            subs = list(self._subs.get(thread_id, []))
+        for loop, queue in subs:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # Loop already closed (subscriber's server shut down)
+                pass
+
+    def _track(self, thread_id: int, event: dict):
+        kind = event["type"]
+        if kind == "start":
+            self._live.setdefault(thread_id, {})[event["key"]] = {
+                "name": event["name"], "reply_to": event["reply_to"], "text": "",
+            }
+        elif kind == "token":
+            item = self._live.get(thread_id, {}).get(event["key"])
+            if item is not None:
+                item["text"] += event["text"]
+        elif kind == "done":
+            # done carries the generation key; persona keys are "<gen_key>:<index>"
+            live = self._live.get(thread_id, {})
+            for key in [k for k in live if k.split(":")[0] == event["key"]]:
+                del live[key]
+            if not live:
+                self._live.pop(thread_id, None)
+
+def _offer(queue: asyncio.Queue, event: dict):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+# Singleton instance
+stream_hub = ThreadStreamHub()
+
+def token_sink(thread_id: int, reply_to_id: int, gen_key: str):
+    """
+    Returns an on_token(index, persona, chunk) callback for _generate_core
+    that forwards chunks of each persona's reply to the thread's subscribers.
+    """
+    started = set()
+
+    def on_token(index: int, persona: str, chunk: str):
+        key = f"{gen_key}:{index}"
+        if key not in started:
+            started.add(key)
+            stream_hub.publish(thread_id, {"type": "start", "key": key, "name": persona, "reply_to": reply_to_id})
+        stream_hub.publish(thread_id, {"type": "token", "key": key, "text": chunk})
+
+    return on_token
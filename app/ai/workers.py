@@ -1,10 +1,12 @@
 ﻿import json
-from app.ai.llm_client import LLMClient
+from app.ai.provider import llm
+from app.http_pool import run_sync
 from app.ai.policy import AIPolicy
 
 class AIWorkers:
-    def __init__(self):
-        self.llm = LLMClient()
+    def _complete(self, system_prompt: str, user_prompt: str, temperature: float) -> str:
+        # Blocking callers (scheduler thread): one-off loop around the async provider chain
+        return run_sync(llm.generate(user_prompt, system=system_prompt, temperature=temperature)).text
 
     def moderation_worker(self, post_body: str) -> dict:
         """
@@ -14,7 +16,7 @@ class AIWorkers:
         user_prompt = AIPolicy.get_moderation_prompt(post_body)
         
         try:
-            raw = self.llm.chat_completion(sys_prompt, user_prompt, temperature=0.0)
+            raw = self._complete(sys_prompt, user_prompt, temperature=0.0)
             # Simple JSON cleanup
             raw = raw.strip().replace("```json", "").replace("```", "")
             return json.loads(raw)
@@ -30,7 +32,7 @@ class AIWorkers:
         user_prompt = AIPolicy.get_engagement_prompt(thread_title, context_posts)
 
         try:
-            raw = self.llm.chat_completion(sys_prompt, user_prompt, temperature=0.7)
+            raw = self._complete(sys_prompt, user_prompt, temperature=0.7)
             raw = raw.strip().replace("```json", "").replace("```", "")
             data = json.loads(raw)
             return data
@@ -0,0 +1,143 @@
+"""
+Online SQLite backups.
+
+Uses SQLite's backup API instead of copying the file: the copy is a
+consistent snapshot (WAL content included) taken BACKUP_PAGES_PER_STEP pages
+at a time, sleeping BACKUP_STEP_SLEEP_MS between steps so writers keep
+getting the lock. A write from another connection makes a stepped backup
+start over; after BACKUP_MAX_RESTARTS restarts the copy is finished in one
+step instead (under WAL that holds a read snapshot only, writers are not
+blocked). A backup still running after BACKUP_DEADLINE_SECONDS is given up.
+The result is integrity-checked before it replaces anything, optionally
+gzipped, and only the newest BACKUP_KEEP are kept.
+
+Blocking: call from a worker thread (the scheduler job does).
+Run `python -m app.backup` for a one-off backup.
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from typing import Optional
+
+from app.db import DB_PATH
+from app.logging import log_error
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "1024"))
+BACKUP_STEP_SLEEP_MS = int(os.getenv("BACKUP_STEP_SLEEP_MS", "10"))
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "0") == "1"
+BACKUP_VERIFY = os.getenv("BACKUP_VERIFY", "1") == "1"
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+BACKUP_DEADLINE_SECONDS = float(os.getenv("BACKUP_DEADLINE_SECONDS", "1800"))
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _prefix() -> str:
+    return os.path.splitext(os.path.basename(DB_PATH))[0] + "_"
+
+
+def _copy_online(src_path: str, dst_path: str, deadline: float):
+    pause = BACKUP_STEP_SLEEP_MS / 1000
+    state = {"remaining": None, "restarts": 0}
+
+    def progress(_status, remaining, _total):
+        # Called after every step. More pages left than last time: a write
+        # from another connection restarted the copy.
+        last = state["remaining"]
+        state["remaining"] = remaining
+        if last is not None and remaining > last:
+            state["restarts"] += 1
+            if state["restarts"] >= BACKUP_MAX_RESTARTS:
+                raise _TooManyRestarts()
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"backup still running after {BACKUP_DEADLINE_SECONDS:g}s")
+        # Let writers in before the next step
+        if pause:
+            time.sleep(pause)
+
+    src = sqlite3.connect(src_path, timeout=30)
+    dst = sqlite3.connect(dst_path)
+    try:
+        try:
+            src.backup(dst, pages=max(1, BACKUP_PAGES_PER_STEP), progress=progress)
+        except _TooManyRestarts:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"backup still running after {BACKUP_DEADLINE_SECONDS:g}s")
+            print(f"[Backup] Restarted {state['restarts']} times by concurrent writes; copying in one step")
+            src.backup(dst, pages=-1)
+        # The copy inherits WAL mode; make it a self-contained single file
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+
+
+def _integrity_check(path: str) -> str:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    return "; ".join(r[0] for r in rows)
+
+
+def _gzip(path: str) -> str:
+    gz_path = path + ".gz"
+    with open(path, "rb") as src, gzip.open(gz_path, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.remove(path)
+    return gz_path
+
+
+def backup_database(db_path: str = DB_PATH, backup_dir: str = BACKUP_DIR) -> Optional[str]:
+    """Returns the path of the new backup, or None if there was nothing to back up or it failed."""
+    if not os.path.exists(db_path):
+        return None
+    os.makedirs(backup_dir, exist_ok=True)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    final_path = os.path.join(backup_dir, f"{_prefix()}{timestamp}.sqlite3")
+    tmp_path = final_path + ".tmp"
+    started = time.monotonic()
+    try:
+        _copy_online(db_path, tmp_path, started + BACKUP_DEADLINE_SECONDS)
+        if BACKUP_VERIFY:
+            result = _integrity_check(tmp_path)
+            if result != "ok":
+                raise RuntimeError(f"integrity check failed: {result[:200]}")
+        os.replace(tmp_path, final_path)
+        if BACKUP_COMPRESS:
+            final_path = _gzip(final_path)
+    except Exception as e:
+        log_error(f"[Backup] Failed: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+    print(f"[Backup] Saved to {final_path} ({time.monotonic() - started:.1f}s)")
+    prune_backups(backup_dir)
+    return final_path
+
+
+def prune_backups(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP):
+    prefix = _prefix()
+    # Timestamped names sort chronologically; unfinished .tmp files are not counted
+    files = sorted(
+        os.path.join(backup_dir, f) for f in os.listdir(backup_dir)
+        if f.startswith(prefix) and f.endswith((".sqlite3", ".sqlite3.gz"))
+    )
+    for f in files[:-keep] if keep > 0 else []:
+        os.remove(f)
+        print(f"[Backup] Removed old: {f}")
+
+
+if __name__ == "__main__":
+    path = backup_database()
+    print(f"[Backup] {'Done: ' + path if path else 'Nothing written'}")
@@ -1,17 +1,70 @@
 ﻿import os
+from sqlalchemy import event, inspect
+from sqlalchemy.pool import QueuePool
 from sqlmodel import SQLModel, create_engine, Session
 
 DB_PATH = os.getenv("DB_PATH", "bbs_v2.sqlite3")
 DATABASE_URL = f"sqlite:///{DB_PATH}"
 
+# SQLite tuning (applied to every new connection)
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")   # WAL: readers and the writer don't block each other
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # safe with WAL, far fewer fsyncs than FULL
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
 engine = create_engine(
     DATABASE_URL,
     echo=False,
-    connect_args={"check_same_thread": False},
+    connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    poolclass=QueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
 )
 
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    try:
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cur.close()
+
 def init_db() -> None:
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
+    _create_missing_indexes()
+
+def _add_missing_columns() -> None:
+    # Same problem for columns. SQLite can only ADD COLUMN without a
+    # non-constant default, so they arrive nullable; callers backfill.
+    existing = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            have = {c["name"] for c in existing.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in have:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}')
+
+def _create_missing_indexes() -> None:
+    # create_all() skips tables that already exist, so indexes added to a
+    # model later never reach older databases. Create them here instead.
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
 
 def get_session() -> Session:
     return Session(engine)
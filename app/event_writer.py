@@ -0,0 +1,200 @@
+"""
+Buffered writer for append-only log rows (AIEvent, AIAuditLog).
+
+Callers hand rows to add() and return immediately. A background thread
+inserts them in a single transaction every EVENT_FLUSH_ROWS rows or
+EVENT_FLUSH_MS milliseconds, whichever comes first, instead of one commit
+(and fsync) per row. The queue is bounded: when it is full, plain events are
+dropped and counted, while durable rows (audit entries) are written inline.
+
+If a batch fails to commit it is retried row by row, so one bad row only
+costs itself. Plain events that still fail are dropped and counted; durable
+rows are kept and retried every EVENT_RETRY_SECONDS until they are written.
+
+AUDIT_DURABILITY=strict writes audit rows synchronously in their own
+transaction; "batched" (default) sends them through the buffer like the rest.
+close() flushes whatever is buffered; the app calls it on shutdown.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from sqlmodel import Session, SQLModel
+
+from app import metrics
+from app.db import engine
+from app.logging import log_error
+
+EVENT_QUEUE_MAX = int(os.getenv("EVENT_QUEUE_MAX", "10000"))
+EVENT_FLUSH_ROWS = int(os.getenv("EVENT_FLUSH_ROWS", "200"))
+EVENT_FLUSH_MS = int(os.getenv("EVENT_FLUSH_MS", "500"))
+EVENT_RETRY_SECONDS = float(os.getenv("EVENT_RETRY_SECONDS", "1"))
+AUDIT_DURABILITY = os.getenv("AUDIT_DURABILITY", "batched").lower()  # strict | batched
+
+metrics.describe("event_rows_written_total", "counter", "Log rows committed by the buffered event writer")
+metrics.describe("event_rows_dropped_total", "counter", "Log rows dropped because the buffer was full or the write failed")
+metrics.describe("event_flushes_total", "counter", "Transactions committed by the buffered event writer")
+metrics.describe("event_queue_depth", "gauge", "Log rows waiting in the event writer buffer")
+metrics.describe("event_retry_depth", "gauge", "Durable log rows that failed to commit and are waiting for a retry")
+
+_STOP = object()
+
+
+def _commit(rows: List[SQLModel]) -> bool:
+    try:
+        with Session(engine) as session:
+            session.add_all(rows)
+            session.commit()
+    except Exception as e:
+        log_error(f"Event writer: failed to write {len(rows)} rows: {e}")
+        return False
+    metrics.inc("event_rows_written_total", len(rows))
+    metrics.inc("event_flushes_total")
+    return True
+
+
+class EventWriter:
+    def __init__(self, max_queue: int = EVENT_QUEUE_MAX, flush_rows: int = EVENT_FLUSH_ROWS, flush_ms: int = EVENT_FLUSH_MS):
+        self.flush_rows = max(1, flush_rows)
+        self.flush_s = max(1, flush_ms) / 1000
+        # (row, durable) pairs
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        # Durable rows that failed to commit (guarded by _lock)
+        self._retry: List[SQLModel] = []
+        metrics.register_collector(self._collect)
+
+    def add(self, row: SQLModel, durable: bool = False):
+        """
+        Queues a row for the next batch. durable=True rows are never dropped:
+        they are written inline when the buffer is full or the writer is closed.
+        """
+        with self._lock:
+            # Checked and enqueued under the lock: close() cannot slip its stop
+            # marker in between, so every queued row is ahead of it
+            if not self._closed:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+                    self._thread.start()
+                try:
+                    self._queue.put_nowait((row, durable))
+                    return
+                except queue.Full:
+                    pass
+        if durable:
+            self._write([(row, True)])
+            if self._closed and not (self._thread and self._thread.is_alive()) and self._pending_retries():
+                log_error(f"Event writer: {self._pending_retries()} durable rows not written after close")
+        else:
+            metrics.inc("event_rows_dropped_total")
+
+    def write_now(self, row: SQLModel) -> bool:
+        """Synchronous, own transaction (strict durability)."""
+        return _commit([row])
+
+    def _write(self, items: List[Tuple[SQLModel, bool]]):
+        if not items or _commit([row for row, _ in items]):
+            return
+        # One bad row must not take the rest of the batch with it
+        failed = []
+        for row, durable in items:
+            if _commit([row]):
+                continue
+            if durable:
+                failed.append(row)
+            else:
+                metrics.inc("event_rows_dropped_total")
+        if failed:
+            with self._lock:
+                self._retry.extend(failed)
+
+    def _retry_durable(self):
+        with self._lock:
+            rows, self._retry = self._retry, []
+        failed = [row for row in rows if not _commit([row])]
+        if failed:
+            with self._lock:
+                self._retry[:0] = failed
+
+    def _pending_retries(self) -> int:
+        with self._lock:
+            return len(self._retry)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=EVENT_RETRY_SECONDS if self._pending_retries() else None)
+            except queue.Empty:
+                self._retry_durable()
+                continue
+            if item is _STOP:
+                break
+            batch, stopping = self._fill_batch(item)
+            self._write(batch)
+            if self._pending_retries():
+                self._retry_durable()
+        # Anything queued behind the stop marker
+        self._write(self._drain())
+        # Durable rows: keep trying for as long as close() waits
+        while self._pending_retries():
+            self._retry_durable()
+            if self._pending_retries():
+                time.sleep(EVENT_RETRY_SECONDS)
+
+    def _fill_batch(self, first) -> Tuple[List[Tuple[SQLModel, bool]], bool]:
+        """Collects up to flush_rows items or flush_s seconds. Returns (batch, stop marker seen)."""
+        batch = [first]
+        deadline = time.monotonic() + self.flush_s
+        while len(batch) < self.flush_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _drain(self) -> List[Tuple[SQLModel, bool]]:
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not _STOP:
+                items.append(item)
+
+    def close(self, timeout: float = 10.0):
+        """Flushes buffered rows and stops the thread. Later add() calls write inline (durable) or drop."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            log_error(f"Event writer: flush on shutdown timed out ({self._pending_retries()} durable rows not written)")
+
+    def _collect(self):
+        yield "event_queue_depth", self._queue.qsize(), {}
+        yield "event_retry_depth", self._pending_retries(), {}
+
+
+# Singleton instance
+event_writer = EventWriter()
+
+# Scripts and jobs outside the app still get their rows flushed
+atexit.register(event_writer.close)
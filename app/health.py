@@ -0,0 +1,90 @@
+"""
+Health checks.
+
+The plain check is what the load balancer polls: one COUNT(*) at most every
+HEALTHZ_CACHE_SECONDS. The deep check is for humans and readiness probes and
+actually touches the DB, Ollama and the scheduler.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import func, text
+from sqlmodel import select
+
+from app.ai.admission import admission
+from app.ai.provider import OLLAMA_MODEL, OLLAMA_URL, llm
+from app.db import get_session
+from app.http_pool import get_client, timeout
+from app.jobs import scheduler
+from app.models import Post
+
+HEALTHZ_CACHE_SECONDS = float(os.getenv("HEALTHZ_CACHE_SECONDS", "5"))
+
+_count_lock = threading.Lock()
+_count_cache = {"value": 0, "at": 0.0}
+
+
+def post_count() -> int:
+    with _count_lock:
+        if time.monotonic() - _count_cache["at"] < HEALTHZ_CACHE_SECONDS:
+            return _count_cache["value"]
+        with get_session() as session:
+            _count_cache["value"] = session.exec(select(func.count()).select_from(Post)).one()
+        _count_cache["at"] = time.monotonic()
+        return _count_cache["value"]
+
+
+def _check_db() -> dict:
+    t0 = time.perf_counter()
+    try:
+        with get_session() as session:
+            session.exec(text("SELECT 1")).one()
+        return {"ok": True, "latency_ms": round((time.perf_counter() - t0) * 1000, 2)}
+    except Exception as e:
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+def _check_ollama() -> dict:
+    t0 = time.perf_counter()
+    try:
+        r = get_client().get(f"{OLLAMA_URL}/api/tags", timeout=timeout(2.0))
+        r.raise_for_status()
+        models = [m.get("name") for m in r.json().get("models", [])]
+        return {
+            "ok": True,
+            "latency_ms": round((time.perf_counter() - t0) * 1000, 2),
+            "model": OLLAMA_MODEL,
+            "model_available": OLLAMA_MODEL in models,
+        }
+    except Exception as e:
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+def _check_scheduler() -> dict:
+    jobs = []
+    if scheduler.running:
+        for job in scheduler.get_jobs():
+            next_run = job.next_run_time.isoformat() if job.next_run_time else None
+            jobs.append({"id": job.id, "name": job.name, "next_run": next_run})
+    return {"running": scheduler.running, "jobs": jobs}
+
+
+def deep_check() -> dict:
+    """DB failure makes the instance unready; Ollama down only degrades AI features."""
+    db = _check_db()
+    ollama = _check_ollama()
+    status = "ok"
+    if not db["ok"]:
+        status = "fail"
+    elif not ollama["ok"]:
+        status = "degraded"
+    return {
+        "status": status,
+        "db": db,
+        "ollama": ollama,
+        "scheduler": _check_scheduler(),
+        "ai_backends": admission.stats(),
+        "llm_providers": llm.stats(),
+        "posts": post_count() if db["ok"] else None,
+    }
@@ -0,0 +1,64 @@
+"""
+Conditional GET for the board and thread pages.
+
+Validators come from ThreadSummary.updated_at, which every write path bumps
+(see app.summary), so re-polling an unchanged page costs one indexed lookup
+and a 304 instead of a render.
+
+Cache-Control lets a reverse proxy store pages but makes it revalidate them
+(conditional request to us) unless HTTP_CACHE_S_MAXAGE grants it a window.
+"""
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "0"))    # browsers
+HTTP_CACHE_S_MAXAGE = int(os.getenv("HTTP_CACHE_S_MAXAGE", "0"))  # shared caches
+
+CACHE_CONTROL = f"public, max-age={HTTP_CACHE_MAX_AGE}, must-revalidate"
+if HTTP_CACHE_S_MAXAGE:
+    CACHE_CONTROL += f", s-maxage={HTTP_CACHE_S_MAXAGE}"
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag over everything the page body depends on."""
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def _utc(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def cache_headers(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_utc(last_modified), usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    # If-None-Match wins when present (RFC 9110 13.2.2)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {t.strip() for t in if_none_match.split(",")}
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = _utc(parsedate_to_datetime(if_modified_since))
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have whole-second resolution
+        return _utc(last_modified).replace(microsecond=0) <= since
+    return False
+
+
+def not_modified(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,98 @@
+"""
+Process-wide pooled HTTP clients for talking to Ollama.
+
+Every Ollama call site borrows these instead of opening a fresh
+httpx.Client per request, so connections are kept alive and reused.
+The sync client is thread-safe and can be used from any thread. Async
+clients cannot move between event loops, so there is one per loop: the
+server's lives until shutdown, and a blocking wrapper that runs its own loop
+goes through run_sync(), which closes that loop's client before returning.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import Awaitable, Optional, TypeVar
+
+import httpx
+
+OLLAMA_TIMEOUT_S = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+OLLAMA_CONNECT_TIMEOUT_S = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "20"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "10"))
+OLLAMA_KEEPALIVE_EXPIRY_S = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+
+_lock = threading.Lock()
+_client: Optional[httpx.Client] = None
+# Entries of loops that were dropped without close_async_client() go with the loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+T = TypeVar("T")
+
+
+def timeout(read_s: Optional[float] = None) -> httpx.Timeout:
+    """Per-request timeout: shared connect timeout, caller-specific read timeout."""
+    return httpx.Timeout(read_s or OLLAMA_TIMEOUT_S, connect=OLLAMA_CONNECT_TIMEOUT_S)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+        keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY_S,
+    )
+
+
+def get_client() -> httpx.Client:
+    global _client
+    if _client is None or _client.is_closed:
+        with _lock:
+            if _client is None or _client.is_closed:
+                _client = httpx.Client(timeout=timeout(), limits=_limits())
+    return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """The running event loop's client."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = _async_clients[loop] = httpx.AsyncClient(timeout=timeout(), limits=_limits())
+    return client
+
+
+async def close_async_client() -> None:
+    """Closes the running event loop's client, if it has one."""
+    with _lock:
+        client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """asyncio.run() for blocking wrappers; the loop's client is closed before the loop ends."""
+    async def scoped() -> T:
+        try:
+            return await coro
+        finally:
+            await close_async_client()
+
+    return asyncio.run(scoped())
+
+
+def open_clients() -> None:
+    # Called on the server's loop, so its async client is the long-lived one
+    get_client()
+    get_async_client()
+
+
+async def close_clients() -> None:
+    global _client
+    await close_async_client()
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
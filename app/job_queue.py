@@ -0,0 +1,232 @@
+"""
+Durable background job queue backed by the Job table.
+
+Handlers are registered per job kind and run on a fixed pool of asyncio
+workers, so a burst of posts queues up instead of spawning unbounded tasks.
+Jobs are claimed by priority, then due time; failures are retried with
+exponential backoff. On shutdown drain() stops claiming, gives in-flight jobs
+JOB_DRAIN_SECONDS to finish and puts the rest back for the next start.
+
+Assumes one app process per database (like the rest of the SQLite setup):
+start() re-queues jobs left "running" by a previous process.
+"""
+import asyncio
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import delete, func, update
+from sqlmodel import Session, select
+
+from app.db import engine
+from app.logging import log_error, log_info
+from app.models import Job
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "30"))
+
+# Lower runs first
+PRIORITY_HUMAN = 0       # replies to a post someone just made
+PRIORITY_CHAIN = 10      # AI-to-AI follow-ups
+PRIORITY_SCHEDULED = 20  # periodic content from the scheduler
+
+Handler = Callable[..., Awaitable[None]]
+
+
+class RetryLater(Exception):
+    """Raised by a handler to run the job again after `delay` seconds without using up an attempt."""
+
+    def __init__(self, delay: float, reason: str = ""):
+        super().__init__(reason or f"retry in {delay:.0f}s")
+        self.delay = delay
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobQueue:
+    def __init__(self):
+        self._handlers: Dict[str, Handler] = {}
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def handler(self, kind: str):
+        """Decorator: registers an async handler; the job payload is passed as kwargs."""
+        def register(fn: Handler) -> Handler:
+            self._handlers[kind] = fn
+            return fn
+        return register
+
+    def enqueue(self, kind: str, payload: Optional[dict] = None, priority: int = PRIORITY_CHAIN,
+                delay: float = 0.0, max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+        """Persists a job and wakes a worker. Safe to call from any thread."""
+        job = Job(
+            kind=kind,
+            payload=json.dumps(payload or {}, ensure_ascii=False),
+            priority=priority,
+            max_attempts=max_attempts,
+            run_at=datetime.utcnow() + timedelta(seconds=delay),
+        )
+        with Session(engine) as session:
+            session.add(job)
+            session.commit()
+            job_id = job.id
+        self._wake()
+        return job_id
+
+    def depth(self) -> int:
+        """Backlog: jobs that are due but not yet picked up by a worker."""
+        with Session(engine) as session:
+            return session.exec(
+                select(func.count()).select_from(Job)
+                .where(Job.status == "queued", Job.run_at <= datetime.utcnow())
+            ).one()
+
+    # --- lifecycle -----------------------------------------------------------
+
+    def start(self, workers: int = JOB_WORKERS):
+        """Call from the event loop (app startup)."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        with Session(engine) as session:
+            recovered = session.exec(
+                update(Job).where(Job.status == "running").values(status="queued")
+            ).rowcount
+            session.commit()
+        if recovered:
+            log_info(f"[Jobs] Re-queued {recovered} interrupted jobs")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+        log_info(f"[Jobs] Started {workers} workers")
+
+    async def drain(self, timeout: float = JOB_DRAIN_SECONDS):
+        """Stop claiming jobs and wait for in-flight ones; the rest go back to the queue."""
+        if not self._workers:
+            return
+        self._stopping = True
+        self._wake()
+        _, pending = await asyncio.wait(self._workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._workers = []
+        log_info(f"[Jobs] Drained ({len(pending)} jobs interrupted and re-queued)")
+
+    def _wake(self):
+        if self._loop is None or self._wakeup is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # Loop already closed
+            pass
+
+    # --- workers -------------------------------------------------------------
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                job = self._claim()
+                if job is None:
+                    # Claim and clear run without yielding, so no wakeup is lost
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self._idle_wait())
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error(f"[Jobs] Worker error: {e}")
+                await asyncio.sleep(JOB_POLL_SECONDS)
+
+    def _claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        with Session(engine) as session:
+            job = session.exec(
+                select(Job)
+                .where(Job.status == "queued", Job.run_at <= now)
+                .order_by(Job.priority, Job.run_at, Job.id)
+                .limit(1)
+            ).first()
+            if job is None:
+                return None
+            claimed = {
+                "id": job.id,
+                "kind": job.kind,
+                "payload": job.payload,
+                "attempts": job.attempts + 1,
+                "max_attempts": job.max_attempts,
+            }
+            won = session.exec(
+                update(Job)
+                .where(Job.id == job.id, Job.status == "queued")
+                .values(status="running", attempts=Job.attempts + 1)
+            ).rowcount
+            session.commit()
+            return claimed if won else None
+
+    def _idle_wait(self) -> float:
+        # Sleep until the next delayed job is due, capped by the poll interval
+        with Session(engine) as session:
+            next_at = session.exec(select(func.min(Job.run_at)).where(Job.status == "queued")).one()
+        if next_at is None:
+            return JOB_POLL_SECONDS
+        return min(JOB_POLL_SECONDS, max(0.05, (next_at - datetime.utcnow()).total_seconds()))
+
+    async def _run(self, job: dict):
+        handler = self._handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise LookupError(f"no handler for job kind {job['kind']!r}")
+            await handler(**json.loads(job["payload"]))
+        except asyncio.CancelledError:
+            self._release(job)
+            raise
+        except RetryLater as e:
+            self._release(job, delay=e.delay)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self._finish(job)
+
+    def _finish(self, job: dict):
+        with Session(engine) as session:
+            session.exec(delete(Job).where(Job.id == job["id"]))
+            session.commit()
+
+    def _release(self, job: dict, delay: float = 0.0):
+        # Interrupted by shutdown or deferred: not the job's fault, so the attempt is not counted
+        values = {"status": "queued", "attempts": Job.attempts - 1}
+        if delay:
+            values["run_at"] = datetime.utcnow() + timedelta(seconds=delay)
+        with Session(engine) as session:
+            session.exec(update(Job).where(Job.id == job["id"]).values(**values))
+            session.commit()
+
+    def _fail(self, job: dict, error: Exception):
+        final = job["attempts"] >= job["max_attempts"]
+        values = {"status": "failed" if final else "queued", "last_error": str(error)[:500]}
+        if not final:
+            values["run_at"] = datetime.utcnow() + timedelta(seconds=_backoff(job["attempts"]))
+        with Session(engine) as session:
+            session.exec(update(Job).where(Job.id == job["id"]).values(**values))
+            session.commit()
+        state = "gave up" if final else "will retry"
+        log_error(f"[Jobs] {job['kind']} #{job['id']} failed (attempt {job['attempts']}/{job['max_attempts']}, {state}): {error}")
+
+
+# Singleton instance
+job_queue = JobQueue()
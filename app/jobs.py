@@ -1,23 +1,37 @@
 ﻿import random
 import asyncio
 import uuid
-import shutil
-import os
-from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from sqlmodel import Session
 from app.db import engine
 from app.models import Post
-from app.ai.multi_reply import generate_multi_replies
+from app.summary import create_summary, bump_summary
+from app.ai.context import note_post
+from app.ai.multi_reply import generate_multi_replies_async
+from app.job_queue import job_queue, RetryLater, PRIORITY_SCHEDULED
+from app.ai.admission import admission, SCHEDULED
+from app.backup import backup_database
 
 scheduler = AsyncIOScheduler()
 
+def enqueue_daily_thread():
+    # The scheduler only queues the work; it runs after human-triggered jobs
+    job_queue.enqueue("daily_thread", priority=PRIORITY_SCHEDULED)
+
+@job_queue.handler("daily_thread")
 async def daily_thread_job():
     """
     Daily automatic thread creation by system AI.
     """
     lang = "jp" # Default JP
+
+    decision = admission.admit(SCHEDULED, lang)
+    if not decision.admitted:
+        if decision.retry_after:
+            raise RetryLater(decision.retry_after, decision.reason)
+        print(f"[Scheduler] Skipped thread creation: {decision.reason}")
+        return
     
     # Generate Topic (Standardized to English to avoid encoding issues)
     topics = [
@@ -34,13 +48,13 @@ async def daily_thread_job():
     ]
     topic = random.choice(topics)
     
+    # Create Thread (Root Post)
+    gen_id = str(uuid.uuid4())
+
+    # Name: "Anonymous" or "Nanashi" in JP
+    name = "名無しさん" if lang == "jp" else "Anonymous"
+
     with Session(engine) as session:
-        # Create Thread (Root Post)
-        gen_id = str(uuid.uuid4())
-        
-        # Name: "Anonymous" or "Nanashi" in JP
-        name = "名無しさん" if lang == "jp" else "Anonymous"
-        
         root = Post(
             language=lang,
             name=name,
@@ -52,18 +66,23 @@ async def daily_thread_job():
             depth=0
         )
         session.add(root)
-        session.commit()
-        session.refresh(root)
+        session.flush()
         
         root.thread_id = root.id
         session.add(root)
+        create_summary(session, root)
         session.commit()
-        
-        print(f"[Scheduler] Created thread #{root.id}: {topic}")
+        session.refresh(root)
+        note_post(root)
+        root_id = root.id
 
-        # Initial AI Replies (Self-acting)
-        replies = generate_multi_replies(topic, lang=lang, context=f"Title: {topic}")
-        
+    print(f"[Scheduler] Created thread #{root_id}: {topic}")
+
+    # Initial AI Replies (Self-acting); no session (pooled connection) is held while the model runs
+    replies = await generate_multi_replies_async(topic, lang=lang, context=f"Title: {topic}", max_personas=decision.max_personas)
+
+    with Session(engine) as session:
+        ai_posts = []
         for r in replies:
             ai_post = Post(
                 language=lang,
@@ -71,47 +90,35 @@ async def daily_thread_job():
                 persona=r["name"],
                 content=r["content"],
                 is_ai=True,
-                reply_to_id=root.id,
-                thread_id=root.id,
+                reply_to_id=root_id,
+                thread_id=root_id,
                 gen_id=gen_id,
                 depth=1
             )
             session.add(ai_post)
+            bump_summary(session, root_id, ai_post)
+            ai_posts.append(ai_post)
         
         session.commit()
-        print(f"[Scheduler] Added {len(replies)} replies to thread #{root.id}")
+        # Keep the thread's cached context window in step (replies may have arrived meanwhile)
+        for ai_post in ai_posts:
+            note_post(ai_post)
+    print(f"[Scheduler] Added {len(replies)} replies to thread #{root_id}")
 
 
-def daily_db_backup_job():
+async def daily_db_backup_job():
     """
-    Daily SQLite Backup. Keep last 7 days.
+    Daily SQLite Backup. Keep last BACKUP_KEEP (7).
+    Online backup API in a worker thread, so the site keeps serving (see app.backup).
     """
-    db_file = "bbs_v2.sqlite3"
-    backup_dir = "backups"
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_path = os.path.join(backup_dir, f"bbs_v2_{timestamp}.sqlite3")
-    
-    # Simple copy
-    if os.path.exists(db_file):
-        shutil.copy2(db_file, backup_path)
-        print(f"[Backup] Saved to {backup_path}")
-    
-    # Cleanup old
-    files = sorted([os.path.join(backup_dir, f) for f in os.listdir(backup_dir) if f.startswith("bbs_v2_")])
-    if len(files) > 7:
-        for f in files[:-7]:
-            os.remove(f)
-            print(f"[Backup] Removed old: {f}")
+    await asyncio.to_thread(backup_database)
 
 def start_scheduler():
     # Run 5 times a day? 
     # For MVP simplicity: Interval every 4 hours approx.
     
     # Add job
-    scheduler.add_job(daily_thread_job, IntervalTrigger(hours=4))
+    scheduler.add_job(enqueue_daily_thread, IntervalTrigger(hours=4))
     
     # Backup Job (Every day at 03:15)
     scheduler.add_job(daily_db_backup_job, 'cron', hour=3, minute=15)
@@ -2,20 +2,35 @@
 from fastapi import FastAPI
 from starlette.requests import Request
 from starlette.exceptions import HTTPException
-from starlette.responses import RedirectResponse, HTMLResponse, PlainTextResponse
+from starlette.responses import RedirectResponse, HTMLResponse, PlainTextResponse, StreamingResponse, JSONResponse
 from starlette.staticfiles import StaticFiles
 from starlette.staticfiles import StaticFiles
-from .renderer import Renderer
+from .renderer import Renderer, tree_cache, build_tree
 from sqlmodel import select
+from sqlalchemy import func
 
 from .db import init_db, get_session
-from .models import Post
-from .ai.multi_reply import generate_multi_replies
-from .ai.chain import maybe_ai_chain
+from .http_pool import open_clients, close_clients
+from .health import post_count, deep_check
+from . import metrics
+from .models import Post, ThreadSummary
+from .pagination import keyset_page, decode_cursor
+from .http_cache import make_etag, cache_headers, is_not_modified, not_modified
+from .search import ensure_search_index, search_available, search_posts, SEARCH_MAX_PAGE
+from .summary import create_summary, bump_summary, set_locked, mark_hidden, ensure_thread_summaries
+from .ai.chain import queue_ai_replies
+from .ai.stream import stream_hub
+from .ai.personas import persona_registry
+from .ai.context import recent_context, note_post, invalidate as invalidate_context
 from .jobs import start_scheduler
-import asyncio
+from .job_queue import job_queue
+from .event_writer import event_writer
 
 import re
+import json
+import asyncio
+from datetime import datetime
+from typing import NamedTuple, Optional
 from app.logging import log_info, log_error
 
 app = FastAPI()
@@ -31,113 +46,238 @@ def _check_lang(lang: str) -> str:
     return lang
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     init_db()
+    ensure_thread_summaries()
+    ensure_search_index()
+    open_clients()
+    job_queue.start()
     # start_scheduler()
     print("STARTUP: DB initialized & Scheduler started")
 
-@app.get("/healthz", response_class=PlainTextResponse)
-def healthz():
-    with get_session() as session:
-        cnt = len(session.exec(select(Post)).all())
-    return f"ok posts={cnt}\n"
-
-def build_tree(posts):
-    nodes = {p.id: {"post": p, "children": []} for p in posts if p.id is not None}
-    roots = []
-    for p in posts:
-        node = nodes.get(p.id)
-        if not node:
-            continue
-        if p.reply_to_id and p.reply_to_id in nodes:
-            nodes[p.reply_to_id]["children"].append(node)
-        else:
-            roots.append(node)
-
-    def sort_children(n):
-        n["children"].sort(key=lambda x: x["post"].created_at)
-        for c in n["children"]:
-            sort_children(c)
-
-    roots.sort(key=lambda x: x["post"].created_at)
-    for r in roots:
-        sort_children(r)
-    return roots
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Let in-flight AI jobs finish while the HTTP clients are still open
+    await job_queue.drain()
+    await close_clients()
+    # Last: the drained jobs may still have queued AIEvent rows
+    event_writer.close()
+
+@app.get("/metrics")
+def metrics_endpoint():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/healthz")
+def healthz(deep: int = 0):
+    # deep=1: DB latency, Ollama reachability and scheduler state as JSON
+    if deep:
+        report = deep_check()
+        return JSONResponse(report, status_code=503 if report["status"] == "fail" else 200)
+    return PlainTextResponse(f"ok posts={post_count()}\n")
 
 @app.get("/", response_class=HTMLResponse)
 def root_redirect(request: Request):
     return RedirectResponse(url="/jp", status_code=302)
 
+THREADS_PER_PAGE = int(os.getenv("THREADS_PER_PAGE", "50"))
+POSTS_PER_PAGE = int(os.getenv("POSTS_PER_PAGE", "200"))
+HTML_MEDIA_TYPE = "text/html; charset=utf-8"
+
+def fetch_thread_page(session, lang: str, after=None, before=None, per_page: int = THREADS_PER_PAGE):
+    """
+    Board page straight from ThreadSummary: an indexed range scan on
+    (language, last_at, thread_id), newest first, keyset-paginated.
+    Returns (threads, prev_cursor, next_cursor).
+    """
+    rows, prev_cursor, next_cursor = keyset_page(
+        session,
+        select(ThreadSummary).where(ThreadSummary.language == lang),
+        ThreadSummary.last_at,
+        ThreadSummary.thread_id,
+        key=lambda th: (th.last_at, th.thread_id),
+        descending=True,
+        limit=per_page,
+        after=after,
+        before=before,
+    )
+    threads = [
+        {
+            "thread_id": th.thread_id,
+            "preview": th.title,
+            "replies": th.reply_count,
+            "last_at": th.last_at,
+            "name": th.name,
+        }
+        for th in rows
+    ]
+    return threads, prev_cursor, next_cursor
+
+def _stream_threads(lang: str, after, before):
+    # Runs after the page head has gone out; opens its own session since the
+    # response body is produced after the handler has returned.
+    with get_session() as session:
+        threads, prev_cursor, next_cursor = fetch_thread_page(session, lang, after=after, before=before)
+    yield from Renderer.iter_threads(threads, lang)
+    yield Renderer.render_pager(lang, f"/{lang}", prev_cursor, next_cursor, newest_first=True)
+
 @app.get("/{lang}", response_class=HTMLResponse)
-def thread_list(request: Request, lang: str):
+def thread_list(request: Request, lang: str, after: str = "", before: str = ""):
     lang = _check_lang(lang)
+    # Any new post, lock or hide on the board moves its newest updated_at
     with get_session() as session:
-        posts = session.exec(
-            select(Post).where(Post.language == lang).order_by(Post.created_at.asc())
-        ).all()
-
-    by_thread = {}
-    for p in posts:
-        tid = p.thread_id or p.id
-        if tid is None:
-            continue
-        item = by_thread.get(tid)
-        if item is None:
-            by_thread[tid] = {
-                "thread_id": tid,
-                "preview": (p.content or "")[:60].replace("\n", " "),
-                "replies": 0,
-                "last_at": p.created_at,
-                "name": p.name,
-            }
-        else:
-            item["replies"] += 1
-            if p.created_at > item["last_at"]:
-                item["last_at"] = p.created_at
-
-    threads = sorted(by_thread.values(), key=lambda x: x["last_at"], reverse=True)
+        last_modified = session.exec(
+            select(func.max(ThreadSummary.updated_at)).where(ThreadSummary.language == lang)
+        ).one()
+    etag = make_etag("board", lang, last_modified, after, before, persona_registry.get(lang).mtime)
+    headers = cache_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(headers)
 
     title = "JP Board" if lang == "jp" else "EN Board"
-    threads_html = Renderer.render_threads(threads, lang)
-    full_html = Renderer.render_index(title, lang, threads_html)
-    return HTMLResponse(full_html)
+    body = _stream_threads(lang, decode_cursor(after), decode_cursor(before))
+    return StreamingResponse(Renderer.iter_index(title, lang, body), media_type=HTML_MEDIA_TYPE, headers=headers)
+
+class TreePost(NamedTuple):
+    # Plain copy of the columns the tree renderer reads
+    id: int
+    reply_to_id: Optional[int]
+    name: str
+    content: str
+    is_ai: bool
+    created_at: datetime
+
+def _tree_post(p) -> TreePost:
+    # Mask Hidden
+    if p.is_hidden:
+        return TreePost(p.id, p.reply_to_id, "[Deleted]", "[Deleted by Admin]", p.is_ai, p.created_at)
+    return TreePost(p.id, p.reply_to_id, p.name, p.content, p.is_ai, p.created_at)
+
+def _load_thread_tree(session, lang: str, thread_id: int, root_post: Post, after: str, before: str):
+    # Oldest first, keyset-paginated on (created_at, id); a page is at most
+    # POSTS_PER_PAGE rows, so the tree is built from one bounded fetch.
+    posts, prev_cursor, next_cursor = keyset_page(
+        session,
+        select(Post.id, Post.reply_to_id, Post.name, Post.content, Post.is_ai, Post.is_hidden, Post.created_at)
+        .where(Post.language == lang)
+        .where(Post.thread_id == thread_id),
+        Post.created_at,
+        Post.id,
+        key=lambda p: (p.created_at, p.id),
+        descending=False,
+        limit=POSTS_PER_PAGE,
+        after=decode_cursor(after),
+        before=decode_cursor(before),
+    )
+    if not posts and not after and not before:
+        posts = [root_post]
+
+    # Replies whose parent is on another page are shown as top-level nodes
+    tree = build_tree([_tree_post(p) for p in posts])
+    return tree, prev_cursor, next_cursor
+
+def _stream_thread_tree(lang: str, thread_id: int, root_post: Post, after: str, before: str, cache_key, last_post_id, generation):
+    # Like _stream_threads: the session is closed before the first chunk goes
+    # out, so a slow reader does not hold a pooled connection.
+    with get_session() as session:
+        tree, prev_cursor, next_cursor = _load_thread_tree(session, lang, thread_id, root_post, after, before)
+
+    # Streams the tree while keeping a copy for the render cache
+    chunks = []
+    for chunk in Renderer.iter_tree(tree, lang):
+        chunks.append(chunk)
+        yield chunk
+    pager = Renderer.render_pager(lang, f"/{lang}/t/{thread_id}", prev_cursor, next_cursor, newest_first=False)
+    chunks.append(pager)
+    yield pager
+    tree_cache.put(cache_key, last_post_id, "".join(chunks), generation)
 
 @app.get("/{lang}/t/{thread_id}", response_class=HTMLResponse)
-def thread_detail(request: Request, lang: str, thread_id: int):
+def thread_detail(request: Request, lang: str, thread_id: int, after: str = "", before: str = ""):
     lang = _check_lang(lang)
+    # Taken before any post is read: a hide that lands while this page
+    # renders keeps the (unmasked) result out of the render cache
+    generation = tree_cache.generation(thread_id)
     with get_session() as session:
-        posts = session.exec(
-            select(Post)
-            .where(Post.language == lang)
-            .where(Post.thread_id == thread_id)
-            .order_by(Post.created_at.asc())
-        ).all()
-
-        if not posts:
-            root = session.exec(
-                select(Post).where(Post.language == lang).where(Post.id == thread_id)
-            ).first()
-            if root:
-                posts = [root]
-
-    if not posts:
-        raise HTTPException(status_code=404, detail="Thread not found")
-        
-    # Check Lock Status (Root post)
-    root_post = posts[0]
-    is_locked = root_post.is_locked
-    
-    # Mask Hidden
-    for p in posts:
-        if p.is_hidden:
-            p.content = "[Deleted by Admin]"
-            p.name = "[Deleted]"
+        # Validators first: a re-poll of an unchanged thread ends here
+        summary = session.get(ThreadSummary, thread_id)
+        last_post_id = session.exec(select(func.max(Post.id)).where(Post.thread_id == thread_id)).one()
+        headers = {}
+        if summary is not None and summary.language == lang:
+            last_modified = summary.updated_at or summary.last_at
+            etag = make_etag(
+                "thread", thread_id, lang, last_post_id, last_modified, after, before,
+                persona_registry.get(lang).mtime,
+            )
+            headers = cache_headers(etag, last_modified)
+            if is_not_modified(request, etag, last_modified):
+                return not_modified(headers)
+
+        root_post = session.exec(
+            select(Post).where(Post.language == lang).where(Post.id == thread_id)
+        ).first()
+        if not root_post:
+            raise HTTPException(status_code=404, detail="Thread not found")
+
+        # Check Lock Status (Root post)
+        is_locked = root_post.is_locked
 
-    tree = build_tree(posts)
-    tree_html = Renderer.render_tree(tree, lang)
     title = f"Thread {thread_id}"
-    full_html = Renderer.render_thread_page(title, lang, thread_id, tree_html, is_locked)
-    return HTMLResponse(full_html)
+    cache_key = (thread_id, lang, after, before)
+    # Rendered trees are reused until the thread gets a newer post
+    tree_html = tree_cache.get(cache_key, last_post_id)
+    if tree_html is not None:
+        return HTMLResponse(Renderer.render_thread_page(title, lang, thread_id, tree_html, is_locked), headers=headers)
+
+    # Cache miss: send the page head at once and the posts as they render
+    tree = _stream_thread_tree(lang, thread_id, root_post, after, before, cache_key, last_post_id, generation)
+    return StreamingResponse(
+        Renderer.iter_thread_page(title, lang, thread_id, tree, is_locked),
+        media_type=HTML_MEDIA_TYPE,
+        headers=headers,
+    )
+
+@app.get("/{lang}/search", response_class=HTMLResponse)
+def search(request: Request, lang: str, q: str = "", page: int = 1):
+    lang = _check_lang(lang)
+    if not search_available():
+        raise HTTPException(status_code=404, detail="search is disabled")
+    q = q.strip()[:200]
+    page = max(1, min(page, SEARCH_MAX_PAGE))
+    results, has_next = [], False
+    if q:
+        with get_session() as session:
+            results, has_next = search_posts(session, lang, q, page=page)
+    results_html = Renderer.render_search_results(results, lang)
+    return HTMLResponse(Renderer.render_search_page(lang, q, results_html, page, has_next))
+
+@app.get("/{lang}/t/{thread_id}/stream")
+async def thread_stream(request: Request, lang: str, thread_id: int):
+    """
+    Server-Sent Events feed of AI replies being generated for this thread.
+    Events: start (new reply box), token (text chunk), done (replies committed as posts).
+    """
+    lang = _check_lang(lang)
+    queue = stream_hub.subscribe(thread_id)
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    ev = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {ev['type']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+        finally:
+            stream_hub.unsubscribe(thread_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/new")
 async def new_post(request: Request):
@@ -191,92 +331,36 @@ async def new_post(request: Request):
             thread_id=thread_id,
         )
         session.add(user_post)
-        session.commit()
-        session.refresh(user_post)
+        session.flush()
 
+        # Post and thread summary change in one transaction
         if parent_id is None:
             user_post.thread_id = user_post.id
             session.add(user_post)
-            session.commit()
+            create_summary(session, user_post)
+        else:
+            bump_summary(session, thread_id, user_post)
+        session.commit()
+        session.refresh(user_post)
+        note_post(user_post)
 
         tid = user_post.thread_id or user_post.id
-
-        recent = session.exec(
-            select(Post)
-            .where(Post.language == lang)
-            .where(Post.thread_id == tid)
-            .order_by(Post.created_at.desc())
-        ).all()[:8]
-        recent = list(reversed(recent))
-        context = "\n".join([f"{('AI-' if p.is_ai else '')}{p.name}: {p.content}" for p in recent if p.content])[:1200]
-
-        # AI処理: 指定人格があるか、ランダム複数か、ランダム単発か
-        ai_posts_created = []
-
-        if ai_persona:
-            replies = generate_multi_replies(content, lang=lang, context=context, specific_persona=ai_persona)
-            if replies:
-                 r = replies[0]
-                 p = Post(
-                    language=lang,
-                    name=r["name"],
-                    persona=r["name"],
-                    content=r["content"],
-                    is_ai=True,
-                    reply_to_id=user_post.id,
-                    thread_id=tid,
-                    depth=1
-                )
-                 session.add(p)
-                 ai_posts_created.append(p)
-            session.commit()
-        elif ai_multi == "1":
-            replies = generate_multi_replies(content, lang=lang, context=context)
-            for r in replies:
-                p = Post(
-                    language=lang,
-                    name=r["name"],
-                    persona=r["name"],
-                    content=r["content"],
-                    is_ai=True,
-                    reply_to_id=user_post.id,
-                    thread_id=tid,
-                    depth=1
-                )
-                session.add(p)
-                ai_posts_created.append(p)
-            session.commit()
-        elif ai == "1":
-            replies = generate_multi_replies(content, lang=lang, context=context)
-            if replies:
-                 r = replies[0]
-                 p = Post(
-                    language=lang,
-                    name="Assistant",
-                    persona="Assistant",
-                    content=r["content"],
-                    is_ai=True,
-                    reply_to_id=user_post.id,
-                    thread_id=tid,
-                    depth=1
-                )
-                 session.add(p)
-                 ai_posts_created.append(p)
-            session.commit()
-
-        # Refresh IDs
-        for p in ai_posts_created:
-            session.refresh(p)
-        
-        # Trigger AI Chain?
-        # Only if there was an AI reply. Pick the last one to reply to?
-        # Or random? User says "choose target post to reply_to (latest ai reply)"
-        if ai_posts_created:
-            latest_ai = ai_posts_created[-1]
-            # Fire and forget (or await if simple)
-            # In production, use BackgroundTasks. For now, await is okay but will slow response.
-            # Using asyncio.create_task to make it non-blocking roughly
-            asyncio.create_task(maybe_ai_chain(tid, latest_ai.id, lang, depth=latest_ai.depth))
+        # Whole cached window; trimmed to the model's token budget when the prompt is built
+        context = recent_context(session, tid)
+        user_post_id = user_post.id
+
+    # AI処理: 指定人格があるか、ランダム複数か、ランダム単発か
+    # Replies are generated by the job queue; the redirect returns right after the human post is committed.
+    mode = None
+    if ai_persona:
+        mode = "specific"
+    elif ai_multi == "1":
+        mode = "multi"
+    elif ai == "1":
+        mode = "single"
+
+    if mode:
+        queue_ai_replies(tid, user_post_id, content, lang, context, mode, persona=ai_persona)
 
     return RedirectResponse(url=f"/{lang}/t/{tid}", status_code=303)
 
@@ -300,7 +384,10 @@ async def admin_hide_post(request: Request, post_id: int):
         if p:
             p.is_hidden = True
             session.add(p)
+            mark_hidden(session, p)
             session.commit()
+            invalidate_context(p.thread_id or p.id)
+            tree_cache.invalidate_thread(p.thread_id or p.id)
             log_info(f"Admin hidden post {post_id}")
     return {"ok": True}
 
@@ -312,10 +399,18 @@ async def admin_lock_thread(request: Request, thread_id: int):
         if root:
             root.is_locked = True
             session.add(root)
+            set_locked(session, thread_id, True)
             session.commit()
             log_info(f"Admin locked thread {thread_id}")
     return {"ok": True}
 
+@app.post("/admin/reload_personas")
+async def admin_reload_personas(request: Request):
+    _check_admin(request)
+    counts = persona_registry.reload()
+    log_info(f"Admin reloaded personas {counts}")
+    return {"ok": True, "personas": counts}
+
 @app.post("/admin/ban_ip")
 async def admin_ban_ip(request: Request):
     _check_admin(request)
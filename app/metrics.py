@@ -0,0 +1,71 @@
+"""
+Process-wide metrics, served in Prometheus text format on /metrics.
+
+Counters are bumped inline with inc(); values that are cheaper to read on
+demand (cache sizes, queue depth) come from collectors run at scrape time.
+"""
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+# A collector yields (name, value, labels) samples of already-described gauges
+Collector = Callable[[], Iterable[Tuple[str, float, Dict[str, str]]]]
+
+_lock = threading.Lock()
+_meta: Dict[str, Tuple[str, str]] = {}        # name -> (type, help)
+_values: Dict[Tuple[str, Labels], float] = {}
+_collectors: List[Collector] = []
+
+
+def describe(name: str, kind: str, help_text: str):
+    """kind: "counter" or "gauge"."""
+    with _lock:
+        _meta[name] = (kind, help_text)
+
+
+def _key(name: str, labels: Dict[str, str]) -> Tuple[str, Labels]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def register_collector(fn: Collector):
+    with _lock:
+        _collectors.append(fn)
+
+
+def snapshot() -> Dict[Tuple[str, Labels], float]:
+    with _lock:
+        values = dict(_values)
+        collectors = list(_collectors)
+    for fn in collectors:
+        for name, value, labels in fn():
+            values[_key(name, labels)] = value
+    return values
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{v}"' for k, v in labels)
+    return "{" + body + "}"
+
+
+def render() -> str:
+    values = snapshot()
+    with _lock:
+        meta = dict(_meta)
+    lines = []
+    for name in sorted({name for name, _ in values}):
+        if name in meta:
+            kind, help_text = meta[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        for (sample, labels), value in sorted(values.items()):
+            if sample == name:
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
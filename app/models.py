@@ -2,9 +2,20 @@
 
 from datetime import datetime
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 class Post(SQLModel, table=True):
+    # Match the hot query shapes (rowid is implicitly the last key column in SQLite):
+    # thread pages / AI context: language + thread_id ordered by created_at
+    # AI chains: thread_id ordered by created_at
+    # board aggregation and summary rebuilds: language ordered by created_at
+    __table_args__ = (
+        Index("ix_post_language_thread_created", "language", "thread_id", "created_at"),
+        Index("ix_post_thread_created", "thread_id", "created_at"),
+        Index("ix_post_language_created", "language", "created_at"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
 
     # jp / en
@@ -48,4 +59,55 @@ class AIEvent(SQLModel, table=True):
     error: Optional[str] = Field(default=None)
     latency_ms: int = Field(default=0)
 
+class AIAuditLog(SQLModel, table=True):
+    """Append-only trail of AI moderation/actions (see app.ai.audit)."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    timestamp: datetime = Field(default_factory=datetime.utcnow, index=True)
+    actor: str = Field(max_length=50)
+    event_type: str = Field(max_length=50, index=True)
+    target_id: Optional[str] = Field(default=None, max_length=100)
+    rule_id: Optional[str] = Field(default=None, max_length=100)
+    reason: Optional[str] = Field(default=None)
+    input_hash: Optional[str] = Field(default=None, max_length=64)
+    raw_payload: Optional[str] = Field(default=None) # JSON
+
+class ThreadSummary(SQLModel, table=True):
+    """
+    Denormalized per-thread row for board listings, maintained on write
+    (see app.summary). thread_id is the root post id.
+    """
+    __table_args__ = (
+        Index("ix_threadsummary_language_last_at", "language", "last_at", "thread_id"),
+        Index("ix_threadsummary_language_updated_at", "language", "updated_at"),
+    )
 
+    thread_id: int = Field(primary_key=True)
+    language: str = Field(default="jp", max_length=5)
+    title: str = Field(default="", max_length=60) # root preview
+    name: str = Field(default="", max_length=50)  # root author
+    reply_count: int = Field(default=0)
+    ai_reply_count: int = Field(default=0)
+    last_at: datetime = Field(default_factory=datetime.utcnow)
+    is_locked: bool = Field(default=False)
+    # Any change to what the thread renders (new post, lock, hide); HTTP validators
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Job(SQLModel, table=True):
+    """
+    Durable background work item, run by app.job_queue.
+    Finished jobs are deleted; failed ones stay for inspection.
+    """
+    __table_args__ = (
+        Index("ix_job_status_priority_run_at", "status", "priority", "run_at", "id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(max_length=40)
+    payload: str = Field(default="{}")  # JSON kwargs for the handler
+    priority: int = Field(default=0)    # lower runs first
+    status: str = Field(default="queued", max_length=10) # queued, running, failed
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=3)
+    run_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_error: Optional[str] = Field(default=None)
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import asyncio
 import os
-from typing import Any, Dict, List, Optional
+import json
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
-import httpx
+from app import metrics
+from app.http_pool import get_async_client, get_client, timeout
 
 try:
     import ollama as ollama_py  # pip install ollama
@@ -12,6 +15,15 @@ except Exception:
 
 Message = Dict[str, str]  # {"role": "...", "content": "..."}
 
+
+def _record_eval(data: Any) -> None:
+    # Final response object: prompt tokens actually evaluated (a reused prefix is not counted)
+    if data.get("prompt_eval_count"):
+        metrics.inc("llm_prompt_eval_tokens_total", data["prompt_eval_count"])
+    if data.get("prompt_eval_duration"):
+        metrics.inc("llm_prompt_eval_seconds_total", data["prompt_eval_duration"] / 1e9)
+
+
 class OllamaClient:
     def __init__(
         self,
@@ -19,11 +31,14 @@ class OllamaClient:
         base_url: Optional[str] = None,
         model: Optional[str] = None,
         timeout_s: float = 120.0,
+        keep_alive: Optional[str] = None,
     ) -> None:
         self.mode = (mode or os.getenv("OLLAMA_MODE", "http")).lower()
         self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
         self.model = model or os.getenv("OLLAMA_MODEL", "llama3.1:8b")
         self.timeout_s = timeout_s
+        # How long Ollama keeps the model (and its prompt cache) loaded after a request
+        self.keep_alive = keep_alive or os.getenv("OLLAMA_KEEP_ALIVE", "30m")
 
     def chat(
         self,
@@ -34,20 +49,9 @@ class OllamaClient:
         num_predict: int = 256,
         seed: Optional[int] = None,
     ) -> str:
-        use_model = model or self.model
-
-        if self.mode == "py":
-            return self._chat_py(
-                model=use_model,
-                messages=messages,
-                temperature=temperature,
-                top_p=top_p,
-                num_predict=num_predict,
-                seed=seed,
-            )
-
-        return self._chat_http(
-            model=use_model,
+        chat = self._chat_py if self.mode == "py" else self._chat_http
+        return chat(
+            model=model or self.model,
             messages=messages,
             temperature=temperature,
             top_p=top_p,
@@ -55,7 +59,106 @@ class OllamaClient:
             seed=seed,
         )
 
-    def _chat_http(
+    async def achat(
+        self,
+        messages: List[Message],
+        model: Optional[str] = None,
+        temperature: float = 0.8,
+        top_p: float = 0.9,
+        num_predict: int = 256,
+        seed: Optional[int] = None,
+    ) -> str:
+        """Async chat over the shared AsyncClient (py mode runs the blocking call in a thread)."""
+        if self.mode == "py":
+            return await asyncio.to_thread(self.chat, messages, model, temperature, top_p, num_predict, seed)
+
+        payload = self._payload(model or self.model, messages, temperature, top_p, num_predict, seed, stream=False)
+        r = await get_async_client().post(self._chat_url(), json=payload, timeout=timeout(self.timeout_s))
+        r.raise_for_status()
+        data = r.json()
+        _record_eval(data)
+        return (data.get("message") or {}).get("content", "").strip()
+
+    def chat_stream(
+        self,
+        messages: List[Message],
+        model: Optional[str] = None,
+        temperature: float = 0.8,
+        top_p: float = 0.9,
+        num_predict: int = 256,
+        seed: Optional[int] = None,
+    ) -> Iterator[str]:
+        """Yields content chunks as Ollama produces them (NDJSON stream)."""
+        use_model = model or self.model
+
+        if self.mode == "py":
+            if ollama_py is None:
+                raise RuntimeError("Pythonのollamaライブラリが見つかりません。`pip install ollama` を実行してください。")
+            for part in ollama_py.chat(
+                model=use_model,
+                messages=messages,
+                options=self._options(temperature, top_p, num_predict, seed),
+                stream=True,
+                keep_alive=self.keep_alive,
+            ):
+                chunk = (part.get("message") or {}).get("content", "")
+                if chunk:
+                    yield chunk
+                if part.get("done"):
+                    _record_eval(part)
+            return
+
+        payload = self._payload(use_model, messages, temperature, top_p, num_predict, seed, stream=True)
+        with get_client().stream("POST", self._chat_url(), json=payload, timeout=timeout(self.timeout_s)) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                chunk, final = self._parse_line(line)
+                if chunk:
+                    yield chunk
+                if final is not None:
+                    _record_eval(final)
+                    break
+
+    async def achat_stream(
+        self,
+        messages: List[Message],
+        model: Optional[str] = None,
+        temperature: float = 0.8,
+        top_p: float = 0.9,
+        num_predict: int = 256,
+        seed: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """Async variant of chat_stream over the shared AsyncClient (py mode yields the whole reply once)."""
+        if self.mode == "py":
+            yield await self.achat(messages, model, temperature, top_p, num_predict, seed)
+            return
+
+        payload = self._payload(model or self.model, messages, temperature, top_p, num_predict, seed, stream=True)
+        async with get_async_client().stream("POST", self._chat_url(), json=payload, timeout=timeout(self.timeout_s)) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                chunk, final = self._parse_line(line)
+                if chunk:
+                    yield chunk
+                if final is not None:
+                    _record_eval(final)
+                    break
+
+    def _chat_url(self) -> str:
+        return f"{self.base_url.rstrip('/')}/api/chat"
+
+    @staticmethod
+    def _options(temperature: float, top_p: float, num_predict: int, seed: Optional[int]) -> Dict[str, Any]:
+        options: Dict[str, Any] = {
+            "temperature": temperature,
+            "top_p": top_p,
+            "num_predict": num_predict,
+        }
+        if seed is not None:
+            options["seed"] = seed
+        return options
+
+    def _payload(
         self,
         model: str,
         messages: List[Message],
@@ -63,25 +166,39 @@ class OllamaClient:
         top_p: float,
         num_predict: int,
         seed: Optional[int],
-    ) -> str:
-        url = f"{self.base_url.rstrip('/')}/api/chat"
-        payload: Dict[str, Any] = {
+        stream: bool,
+    ) -> Dict[str, Any]:
+        return {
             "model": model,
             "messages": messages,
-            "stream": False,
-            "options": {
-                "temperature": temperature,
-                "top_p": top_p,
-                "num_predict": num_predict,
-            },
+            "stream": stream,
+            "options": self._options(temperature, top_p, num_predict, seed),
+            "keep_alive": self.keep_alive,
         }
-        if seed is not None:
-            payload["options"]["seed"] = seed
 
-        with httpx.Client(timeout=self.timeout_s) as client:
-            r = client.post(url, json=payload)
-            r.raise_for_status()
-            data = r.json()
+    @staticmethod
+    def _parse_line(line: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """(content chunk, the final object once Ollama reports done)."""
+        if not line:
+            return "", None
+        data = json.loads(line)
+        return (data.get("message") or {}).get("content", ""), data if data.get("done") else None
+
+    def _chat_http(
+        self,
+        model: str,
+        messages: List[Message],
+        temperature: float,
+        top_p: float,
+        num_predict: int,
+        seed: Optional[int],
+    ) -> str:
+        payload = self._payload(model, messages, temperature, top_p, num_predict, seed, stream=False)
+
+        r = get_client().post(self._chat_url(), json=payload, timeout=timeout(self.timeout_s))
+        r.raise_for_status()
+        data = r.json()
+        _record_eval(data)
 
         return (data.get("message") or {}).get("content", "").strip()
 
@@ -97,18 +214,12 @@ class OllamaClient:
         if ollama_py is None:
             raise RuntimeError("Pythonのollamaライブラリが見つかりません。`pip install ollama` を実行してください。")
 
-        options: Dict[str, Any] = {
-            "temperature": temperature,
-            "top_p": top_p,
-            "num_predict": num_predict,
-        }
-        if seed is not None:
-            options["seed"] = seed
-
         res = ollama_py.chat(
             model=model,
             messages=messages,
-            options=options,
+            options=self._options(temperature, top_p, num_predict, seed),
             stream=False,
+            keep_alive=self.keep_alive,
         )
+        _record_eval(res)
         return (res.get("message") or {}).get("content", "").strip()
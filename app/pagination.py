@@ -0,0 +1,81 @@
+"""
+Keyset (cursor) pagination on a (timestamp, id) key.
+
+A cursor is the key of the first/last row of the current page, so every page
+is an index range scan of `limit + 1` rows no matter how deep it is.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import tuple_
+
+Key = Tuple[datetime, int]
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def encode_cursor(key: Key) -> str:
+    at, row_id = key
+    micros = (at - _EPOCH) // timedelta(microseconds=1)
+    return f"{micros}.{row_id}"
+
+
+def decode_cursor(raw: Optional[str]) -> Optional[Key]:
+    """Returns None for missing or malformed cursors (treated as the first page)."""
+    if not raw:
+        return None
+    try:
+        micros, row_id = raw.split(".", 1)
+        return _EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+    except (ValueError, OverflowError):
+        return None
+
+
+def keyset_page(
+    session,
+    stmt,
+    at_col,
+    id_col,
+    key: Callable[[object], Key],
+    *,
+    descending: bool,
+    limit: int,
+    after: Optional[Key] = None,
+    before: Optional[Key] = None,
+):
+    """
+    Runs stmt ordered by (at_col, id_col) in display order.
+    `after` fetches the page following that key, `before` the page preceding it.
+    Returns (rows, prev_cursor, next_cursor); cursors are None at either end.
+    """
+    going_back = before is not None and after is None
+    cursor = before if going_back else after
+    # Scan direction: reversed when walking back towards the first page
+    scan_desc = descending != going_back
+
+    base_stmt = stmt
+    key_cols = tuple_(at_col, id_col)
+    if cursor is not None:
+        bound = tuple_(*cursor)
+        stmt = stmt.where(key_cols < bound if scan_desc else key_cols > bound)
+    if scan_desc:
+        stmt = stmt.order_by(at_col.desc(), id_col.desc())
+    else:
+        stmt = stmt.order_by(at_col.asc(), id_col.asc())
+
+    rows = list(session.exec(stmt.limit(limit + 1)).all())
+    if going_back and not rows:
+        # Stale cursor from before the first page: show the first page
+        return keyset_page(session, base_stmt, at_col, id_col, key, descending=descending, limit=limit)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if going_back:
+        rows.reverse()
+
+    has_prev = more if going_back else cursor is not None
+    has_next = True if going_back else more
+    prev_cursor = encode_cursor(key(rows[0])) if rows and has_prev else None
+    next_cursor = encode_cursor(key(rows[-1])) if rows and has_next else None
+    return rows, prev_cursor, next_cursor
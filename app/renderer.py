@@ -1,31 +1,191 @@
 import html
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import urlencode
+from app.ai.personas import persona_registry
 
 def escape(s):
     return html.escape(str(s) if s else "")
 
+@lru_cache(maxsize=8)
+def _persona_options(cfg):
+    # cfg is an immutable PersonaConfig, so a reload yields a new cache key
+    return "".join(
+        f'''
+          <option value="{escape(p.name)}">{escape(p.name)}{f" ({escape(p.label)})" if p.label else ""}</option>'''
+        for p in cfg.personas
+    )
+
+@lru_cache(maxsize=8)
+def _reply_template(lang, cfg):
+    placeholder = "返信..." if lang=="jp" else "Reply..."
+    check_text_multi = "AIが複数人でレス（2ch風）" if lang=="jp" else "AI multi-replies (forum vibe)"
+    check_text_single = "AI単発返信（1件）" if lang=="jp" else "Single AI reply"
+    return f'''
+<template id="reply-form-template">
+      <form class="form" method="post" action="/new">
+        <input type="hidden" name="lang" value="{lang}" />
+        <input type="hidden" name="reply_to_id" value="" />
+
+        <label class="label">Name</label>
+        <input class="input" name="name" placeholder="Anonymous" maxlength="50" />
+
+        <label class="label">Reply</label>
+        <textarea class="textarea" name="content" placeholder="{placeholder}" maxlength="2000" required></textarea>
+
+        <label class="label">AI Persona (Optional)</label>
+        <select class="input" name="ai_persona">
+          <option value="">-- Random / Default --</option>
+          {_persona_options(cfg)}
+        </select>
+
+        <label class="check">
+          <input type="checkbox" name="ai_multi" value="1" />
+          <span>{check_text_multi}</span>
+        </label>
+
+        <label class="check">
+          <input type="checkbox" name="ai" value="1" />
+          <span>{check_text_single}</span>
+        </label>
+
+        <button class="btn" type="submit">Send</button>
+      </form>
+</template>'''
+
+_SLOT = "\x00slot\x00"
+
+def _iter_around(page, chunks):
+    head, tail = page.split(_SLOT, 1)
+    yield head
+    yield from chunks
+    yield tail
+
+def build_tree(posts):
+    """
+    Nests posts under their reply_to_id parent. Posts are sorted once by
+    (created_at, id); appending in that order leaves every children list
+    already sorted, so there is no per-node sort and no recursion.
+    Posts whose parent is not in `posts` become roots.
+    """
+    ordered = sorted(posts, key=lambda p: (p.created_at, p.id or 0))
+    nodes = {p.id: {"post": p, "children": []} for p in ordered if p.id is not None}
+    roots = []
+    for p in ordered:
+        node = nodes.get(p.id)
+        if not node:
+            continue
+        parent = nodes.get(p.reply_to_id) if p.reply_to_id and p.reply_to_id != p.id else None
+        if parent is not None:
+            parent["children"].append(node)
+        else:
+            roots.append(node)
+    return roots
+
+class TreeCache:
+    """
+    LRU of rendered thread-tree HTML keyed by (thread_id, lang, page).
+    Each entry remembers the thread's newest post id when it was rendered;
+    a newer post changes that id, so stale entries simply miss.
+    Edits that keep that id (admin hide) bump the thread's generation
+    instead: a render that started before the bump is not stored.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def generation(self, thread_id):
+        # Read before loading the posts; pass to put() once rendered
+        with self._lock:
+            return self._generations.get(thread_id, 0)
+
+    def get(self, key, last_post_id):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != last_post_id:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, last_post_id, value, generation=0):
+        with self._lock:
+            if self._generations.get(key[0], 0) != generation:
+                return
+            self._entries[key] = (last_post_id, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_thread(self, thread_id):
+        # Edits that don't add a post (admin hide) must drop pages explicitly
+        with self._lock:
+            self._generations[thread_id] = self._generations.get(thread_id, 0) + 1
+            for key in [k for k in self._entries if k[0] == thread_id]:
+                del self._entries[key]
+
+tree_cache = TreeCache(int(os.getenv("RENDER_CACHE_ENTRIES", "256")))
+
 class Renderer:
     @staticmethod
-    def render_threads(threads, lang):
-        lines = []
+    def persona_options(lang):
+        return _persona_options(persona_registry.get(lang))
+
+    @staticmethod
+    def iter_threads(threads, lang):
         for th in threads:
             url = f"/{lang}/t/{th['thread_id']}"
             last = th['last_at'].strftime("%Y-%m-%d %H:%M:%S")
-            lines.append(f'''
+            yield f'''
     <a class="thread" href="{url}">
       <div class="thread-top">
         <div class="thread-title">#{th['thread_id']} {escape(th['preview'])}</div>
         <div class="thread-meta">replies: {th['replies']} / last: {last} UTC</div>
       </div>
       <div class="muted">by {escape(th['name'])}</div>
-    </a>''')
-        return "\n".join(lines)
+    </a>'''
+
+    @staticmethod
+    def render_pager(lang, base_url, prev_cursor, next_cursor, newest_first):
+        # Cursor links: "before" walks back towards the first page, "after" forward
+        if newest_first:
+            prev_text = "← 新しい" if lang == "jp" else "← Newer"
+            next_text = "古い →" if lang == "jp" else "Older →"
+        else:
+            prev_text = "← 前へ" if lang == "jp" else "← Previous"
+            next_text = "次へ →" if lang == "jp" else "Next →"
+        links = []
+        if prev_cursor:
+            links.append(f'<a href="{base_url}?before={prev_cursor}">{prev_text}</a>')
+        if next_cursor:
+            links.append(f'<a href="{base_url}?after={next_cursor}">{next_text}</a>')
+        if not links:
+            return ""
+        return f'''
+    <div class="row pager">{" ".join(links)}</div>'''
 
     @staticmethod
     def render_tree(tree, lang):
-        lines = []
-        for node in tree:
-            lines.append(Renderer._render_node(node, 0, lang))
-        return "\n".join(lines)
+        return "".join(Renderer.iter_tree(tree, lang))
+
+    @staticmethod
+    def iter_tree(tree, lang):
+        """
+        Yields post HTML in display order (depth-first, children oldest first).
+        Uses an explicit stack, so reply-chain depth is not bounded by the
+        Python recursion limit.
+        """
+        stack = [(node, 0) for node in reversed(tree)]
+        while stack:
+            node, depth = stack.pop()
+            yield Renderer._render_node(node, depth, lang)
+            children = node["children"]
+            for i in range(len(children) - 1, -1, -1):
+                stack.append((children[i], depth + 1))
 
     @staticmethod
     def _render_node(node, depth, lang):
@@ -38,28 +198,12 @@ class Renderer:
         
         reply_anchor = f'<span class="muted">(>>{p.reply_to_id})</span>' if p.reply_to_id else ""
         
-        # Reply form (simplified)
+        # Reply form: one shared <template> per page (render_reply_template),
+        # cloned into this box by app.js when it is opened
         reply_text = "このレスに返信" if lang=="jp" else "Reply"
-        placeholder = "返信..." if lang=="jp" else "Reply..."
-        
-        # Options
-        opts_jp = '''
-          <option value="風吹けば名無し">風吹けば名無し (Meme/Short)</option>
-          <option value="冷静マン">冷静マン (Logical)</option>
-          <option value="ツッコミ隊">ツッコミ隊 (Skeptic)</option>
-          <option value="経験者ニキ">経験者ニキ (Experienced)</option>'''
-        opts_en = '''
-          <option value="Anon">Anon (Meme/Short)</option>
-          <option value="Skeptic">Skeptic (Critical)</option>
-          <option value="Pragmatist">Pragmatist (Logical)</option>
-          <option value="BeenThere">BeenThere (Experienced)</option>'''
-        opts = opts_jp if lang=="jp" else opts_en
-        
-        check_text_multi = "AIが複数人でレス（2ch風）" if lang=="jp" else "AI multi-replies (forum vibe)"
-        check_text_single = "AI単発返信（1件）" if lang=="jp" else "Single AI reply"
         
         html_chunk = f'''
-  <article class="post {cls}" style="--depth: {depth}; margin-left: calc(var(--depth) * 18px);">
+  <article class="post {cls}" id="p{p.id}" style="--depth: {depth}; margin-left: calc(var(--depth) * 18px);">
     <div class="post-head">
       <div class="name">
         <span class="name {name_cls}">{name}</span>
@@ -69,46 +213,14 @@ class Renderer:
       <div class="time">{p.created_at.strftime("%Y-%m-%d %H:%M:%S")} UTC</div>
     </div>
     <div class="content">{escape(p.content)}</div>
-
-    <details class="replybox">
-      <summary class="replybtn">{reply_text}</summary>
-      <form class="form" method="post" action="/new">
-        <input type="hidden" name="lang" value="{lang}" />
-        <input type="hidden" name="reply_to_id" value="{p.id}" />
-
-        <label class="label">Name</label>
-        <input class="input" name="name" placeholder="Anonymous" maxlength="50" />
-
-        <label class="label">Reply</label>
-        <textarea class="textarea" name="content" placeholder="{placeholder}" maxlength="2000" required></textarea>
-
-        <label class="label">AI Persona (Optional)</label>
-        <select class="input" name="ai_persona">
-          <option value="">-- Random / Default --</option>
-          {opts}
-        </select>
-
-        <label class="check">
-          <input type="checkbox" name="ai_multi" value="1" />
-          <span>{check_text_multi}</span>
-        </label>
-
-        <label class="check">
-          <input type="checkbox" name="ai" value="1" />
-          <span>{check_text_single}</span>
-        </label>
-
-        <button class="btn" type="submit">Send</button>
-      </form>
-    </details>
+    <details class="replybox" data-reply-to="{p.id}"><summary class="replybtn">{reply_text}</summary></details>
   </article>'''
         
-        # Recursion
-        children_html = []
-        for child in node["children"]:
-            children_html.append(Renderer._render_node(child, depth + 1, lang))
-            
-        return html_chunk + "".join(children_html)
+        return html_chunk
+
+    @staticmethod
+    def render_reply_template(lang):
+        return _reply_template(lang, persona_registry.get(lang))
 
     @staticmethod
     def render_layout(title, body, lang):
@@ -145,6 +257,16 @@ class Renderer:
 </body>
 </html>'''
 
+    # Streaming variants: render the page once around a slot marker, emit the
+    # part before it right away, then the chunks as the caller produces them.
+    @staticmethod
+    def iter_index(title, lang, thread_chunks):
+        return _iter_around(Renderer.render_index(title, lang, _SLOT), thread_chunks)
+
+    @staticmethod
+    def iter_thread_page(title, lang, thread_id, tree_chunks, is_locked):
+        return _iter_around(Renderer.render_thread_page(title, lang, thread_id, _SLOT, is_locked), tree_chunks)
+
     @staticmethod
     def render_index(title, lang, threads_html):
         h2_title = "日本語板" if lang == "jp" else "English Board"
@@ -153,12 +275,8 @@ class Renderer:
         btn_create = "Create Thread"
         h2_list = "スレ一覧" if lang == "jp" else "Threads"
         
-        opts_jp = '''<option value="風吹けば名無し">風吹けば名無し (Meme/Short)</option> ...''' # truncated for brevity in code, but full in implementation
-        # Actually I can just reuse the generic structure.
-        
-        # Simplified options for index
-        # To avoid duplicating logic, I'll put direct HTML here.
-        
+        opts = Renderer.persona_options(lang)
+
         body = f'''
 <section class="card">
   <div class="row">
@@ -167,6 +285,7 @@ class Renderer:
       <a href="/jp">/jp</a> | <a href="/en">/en</a>
     </div>
   </div>
+  {Renderer.render_search_form(lang)}
 </section>
 
 <section class="card">
@@ -178,7 +297,7 @@ class Renderer:
     <label class="label">Content</label>
     <textarea class="textarea" name="content" placeholder="{ph_content}" maxlength="2000" required></textarea>
     <label class="label">AI Persona</label>
-    <select class="input" name="ai_persona"><option value="">-- Defaults --</option></select>
+    <select class="input" name="ai_persona"><option value="">-- Defaults --</option>{opts}</select>
     <div class="check"><input type="checkbox" name="ai_multi" value="1"> <span>Multi AI</span></div>
     <div class="check"><input type="checkbox" name="ai" value="1"> <span>Single AI</span></div>
     <button class="btn" type="submit">{btn_create}</button>
@@ -193,11 +312,64 @@ class Renderer:
 </section>'''
         return Renderer.render_layout(title, body, lang)
 
+    @staticmethod
+    def render_search_form(lang, q=""):
+        ph = "スレ・レスを検索" if lang == "jp" else "Search posts"
+        return f'''<form class="search" method="get" action="/{lang}/search">
+    <input class="input" type="search" name="q" value="{escape(q)}" placeholder="{ph}" maxlength="200" />
+  </form>'''
+
+    @staticmethod
+    def render_search_results(results, lang):
+        lines = []
+        for r in results:
+            # Escape first, then turn the snippet markers into <mark>
+            snippet = escape(r["snippet"]).replace("\x02", "<mark>").replace("\x03", "</mark>")
+            name = f"{'AI-' if r['is_ai'] else ''}{escape(r['name'])}"
+            lines.append(f'''
+    <a class="thread" href="/{lang}/t/{r['thread_id']}#p{r['id']}">
+      <div class="thread-top">
+        <div class="thread-title">#{r['thread_id']} &gt;&gt;{r['id']} {name}</div>
+        <div class="thread-meta">{str(r['created_at'])[:19]} UTC</div>
+      </div>
+      <div class="muted">{snippet}</div>
+    </a>''')
+        return "\n".join(lines)
+
+    @staticmethod
+    def render_search_page(lang, q, results_html, page, has_next):
+        h2 = "検索" if lang == "jp" else "Search"
+        empty = "見つかりませんでした。" if lang == "jp" else "No results."
+        links = []
+        if page > 1:
+            links.append(f'<a href="/{lang}/search?{urlencode({"q": q, "page": page - 1})}">{"← 前へ" if lang == "jp" else "← Previous"}</a>')
+        if has_next:
+            links.append(f'<a href="/{lang}/search?{urlencode({"q": q, "page": page + 1})}">{"次へ →" if lang == "jp" else "Next →"}</a>')
+        pager = f'<div class="row pager">{" ".join(links)}</div>' if links else ""
+        body = f'''
+<section class="card">
+  <div class="row">
+    <h2 class="h2">{h2}</h2>
+    <div class="muted"><a href="/{lang}">/{lang}</a></div>
+  </div>
+  {Renderer.render_search_form(lang, q)}
+</section>
+
+<section class="card">
+  <div class="threads">
+    {results_html or (f'<div class="muted">{empty}</div>' if q else "")}
+  </div>
+  {pager}
+</section>'''
+        return Renderer.render_layout(f"{h2}: {q}" if q else h2, body, lang)
+
     @staticmethod
     def render_thread_page(title, lang, thread_id, tree_html, is_locked):
         h2_title = "スレッド" if lang=="jp" else "Thread"
         back_text = "スレ一覧へ" if lang=="jp" else "Back to threads"
         reply_header = "返信する" if lang=="jp" else "Reply"
+        live_header = "AIが書き込み中..." if lang=="jp" else "AI is typing..."
+        reply_template = "" if is_locked else Renderer.render_reply_template(lang)
         
         lock_msg = ""
         if is_locked:
@@ -235,9 +407,15 @@ class Renderer:
   {form_html}
 </section>
 
+<section class="card live" id="live-replies" data-stream-url="/{lang}/t/{thread_id}/stream" hidden>
+  <h2 class="h2">{live_header}</h2>
+  <div class="live-list"></div>
+</section>
+
 <section class="card">
-  <div class="tree">
+  <div class="tree{" locked" if is_locked else ""}">
     {tree_html}
   </div>
-</section>'''
+</section>
+{reply_template}'''
         return Renderer.render_layout(title, body, lang)
@@ -0,0 +1,162 @@
+"""
+Full-text search over posts.
+
+post_fts is an FTS5 index over Post.content/name using the trigram
+tokenizer, so Japanese (no spaces between words) matches on any substring of
+3+ characters. It is an external-content table kept in sync by triggers on
+the post table, so every writer (new_post, AI replies, chains, scheduled
+threads, admin hide) is covered without code changes. Hidden posts are
+removed from the index.
+
+Terms shorter than 3 characters cannot use the trigram index; they fall
+back to a LIKE filter over the FTS matches (or, alone, over the language's
+posts) — correct, but a scan.
+
+The trigram tokenizer needs SQLite 3.34+. On an older SQLite the startup
+hook logs the error and leaves search disabled; the board still runs.
+"""
+import os
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.db import engine
+from app.logging import log_error
+
+SEARCH_PER_PAGE = int(os.getenv("SEARCH_PER_PAGE", "20"))
+SEARCH_MAX_PAGE = int(os.getenv("SEARCH_MAX_PAGE", "50"))
+SNIPPET_TOKENS = 32
+
+# Snippet highlight markers (control chars never appear in escaped post text)
+MARK_START = "\x02"
+MARK_END = "\x03"
+
+_FTS_TABLE = """CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(
+    content, name, content='post', content_rowid='id', tokenize='trigram'
+)"""
+
+_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS post_fts_ai AFTER INSERT ON post WHEN new.is_hidden = 0 BEGIN
+        INSERT INTO post_fts(rowid, content, name) VALUES (new.id, new.content, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_ad AFTER DELETE ON post WHEN old.is_hidden = 0 BEGIN
+        INSERT INTO post_fts(post_fts, rowid, content, name) VALUES ('delete', old.id, old.content, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_au AFTER UPDATE OF content, name, is_hidden ON post BEGIN
+        INSERT INTO post_fts(post_fts, rowid, content, name)
+            SELECT 'delete', old.id, old.content, old.name WHERE old.is_hidden = 0;
+        INSERT INTO post_fts(rowid, content, name)
+            SELECT new.id, new.content, new.name WHERE new.is_hidden = 0;
+    END""",
+]
+
+
+_enabled = False
+
+
+def search_available() -> bool:
+    """False until ensure_search_index() has run, and for good on an SQLite without trigram."""
+    return _enabled
+
+
+def ensure_search_index():
+    """Startup hook: creates the index and triggers, backfilling on first run."""
+    global _enabled
+    with engine.begin() as conn:
+        existed = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'post_fts'")
+        ).first() is not None
+        try:
+            conn.execute(text(_FTS_TABLE))
+        except OperationalError as e:
+            # e.g. "no such tokenizer: trigram"; no triggers either, or every insert would fail
+            log_error(f"[Search] Disabled, cannot create post_fts: {e.orig}")
+            return
+        for stmt in _TRIGGERS:
+            conn.execute(text(stmt))
+        if not existed:
+            conn.execute(text(
+                "INSERT INTO post_fts(rowid, content, name) SELECT id, content, name FROM post WHERE is_hidden = 0"
+            ))
+    _enabled = True
+
+
+def rebuild_search_index():
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO post_fts(post_fts) VALUES ('delete-all')"))
+        conn.execute(text(
+            "INSERT INTO post_fts(rowid, content, name) SELECT id, content, name FROM post WHERE is_hidden = 0"
+        ))
+
+
+def _split_terms(q: str) -> Tuple[List[str], List[str]]:
+    terms = [t for t in q.split() if t][:10]
+    return [t for t in terms if len(t) >= 3], [t for t in terms if len(t) < 3]
+
+
+def _fts_phrase(term: str) -> str:
+    # Quoted FTS5 string: operators and punctuation in user input are literal
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like(term: str) -> str:
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def search_posts(session, lang: str, q: str, page: int = 1, per_page: int = SEARCH_PER_PAGE):
+    """
+    Ranked matches (bm25) for every whitespace-separated term in q.
+    Returns (results, has_next); each result is a dict with id, thread_id,
+    name, is_ai, created_at and snippet (raw text with MARK_START/MARK_END).
+    """
+    long_terms, short_terms = _split_terms(q)
+    if not long_terms and not short_terms:
+        return [], False
+    page = max(1, min(page, SEARCH_MAX_PAGE))
+    params = {"lang": lang, "limit": per_page + 1, "offset": (page - 1) * per_page}
+
+    likes = []
+    for i, term in enumerate(short_terms):
+        params[f"like{i}"] = _like(term)
+        likes.append(f"AND (p.content LIKE :like{i} ESCAPE '\\' OR p.name LIKE :like{i} ESCAPE '\\')")
+
+    if long_terms:
+        params["match"] = " ".join(_fts_phrase(t) for t in long_terms)
+        sql = f"""
+            SELECT p.id, p.thread_id, p.name, p.is_ai, p.created_at,
+                   snippet(post_fts, 0, '{MARK_START}', '{MARK_END}', '…', {SNIPPET_TOKENS}) AS snip
+            FROM post_fts
+            JOIN post AS p ON p.id = post_fts.rowid
+            WHERE post_fts MATCH :match AND p.language = :lang {" ".join(likes)}
+            ORDER BY post_fts.rank
+            LIMIT :limit OFFSET :offset"""
+    else:
+        sql = f"""
+            SELECT p.id, p.thread_id, p.name, p.is_ai, p.created_at, substr(p.content, 1, 120) AS snip
+            FROM post AS p
+            WHERE p.language = :lang AND p.is_hidden = 0 {" ".join(likes)}
+            ORDER BY p.created_at DESC, p.id DESC
+            LIMIT :limit OFFSET :offset"""
+
+    rows = session.connection().execute(text(sql), params).all()
+    results = [
+        {
+            "id": r.id,
+            "thread_id": r.thread_id or r.id,
+            "name": r.name,
+            "is_ai": bool(r.is_ai),
+            "created_at": r.created_at,
+            "snippet": r.snip or "",
+        }
+        for r in rows[:per_page]
+    ]
+    return results, len(rows) > per_page
+
+
+if __name__ == "__main__":
+    from app.db import init_db
+    init_db()
+    ensure_search_index()
+    rebuild_search_index()
+    print("[Search] Rebuilt post_fts")
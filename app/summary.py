@@ -0,0 +1,123 @@
+﻿"""
+Maintenance of the ThreadSummary table.
+
+Writers call these helpers inside their own session, before commit, so the
+summary row changes in the same transaction as the posts it describes.
+Run `python -m app.summary` to rebuild every row from the Post table.
+"""
+from datetime import datetime
+from sqlalchemy import Integer, cast, delete, func, update
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
+from app.db import engine, init_db
+from app.models import Post, ThreadSummary
+
+HIDDEN_TITLE = "[Deleted by Admin]"
+
+def _preview(content: str) -> str:
+    return (content or "")[:60].replace("\n", " ")
+
+def create_summary(session: Session, root: Post) -> ThreadSummary:
+    """New thread: root must already have an id (flush first)."""
+    summary = ThreadSummary(
+        thread_id=root.id,
+        language=root.language,
+        title=_preview(root.content),
+        name=root.name or "",
+        last_at=root.created_at,
+        is_locked=root.is_locked,
+        updated_at=root.created_at,
+    )
+    session.add(summary)
+    return summary
+
+def bump_summary(session: Session, thread_id: int, post: Post):
+    """A reply was added to thread_id."""
+    summary = session.get(ThreadSummary, thread_id)
+    if summary is None:
+        return
+    summary.reply_count += 1
+    if post.is_ai:
+        summary.ai_reply_count += 1
+    if post.created_at and post.created_at > summary.last_at:
+        summary.last_at = post.created_at
+    summary.updated_at = datetime.utcnow()
+    session.add(summary)
+
+def set_locked(session: Session, thread_id: int, locked: bool = True):
+    summary = session.get(ThreadSummary, thread_id)
+    if summary is not None:
+        summary.is_locked = locked
+        summary.updated_at = datetime.utcnow()
+        session.add(summary)
+
+def mark_hidden(session: Session, post: Post):
+    """Hiding a root post also hides its preview on the board."""
+    is_root = post.thread_id in (None, post.id)
+    summary = session.get(ThreadSummary, post.id if is_root else post.thread_id)
+    if summary is None:
+        return
+    if is_root:
+        summary.title = HIDDEN_TITLE
+        summary.name = "[Deleted]"
+    summary.updated_at = datetime.utcnow()
+    session.add(summary)
+
+def rebuild_thread_summaries() -> int:
+    """Backfill: rebuilds ThreadSummary from Post in one transaction. Returns the thread count."""
+    tid = func.coalesce(Post.thread_id, Post.id)
+    stats = (
+        select(
+            tid.label("thread_id"),
+            func.count().label("posts"),
+            func.sum(cast(Post.is_ai, Integer)).label("ai_posts"),
+            func.max(Post.created_at).label("last_at"),
+        )
+        .group_by(tid)
+        .subquery()
+    )
+    root = aliased(Post)
+    with Session(engine) as session:
+        rows = session.exec(
+            select(root, stats.c.posts, stats.c.ai_posts, stats.c.last_at)
+            .join(stats, stats.c.thread_id == root.id)
+        ).all()
+
+        session.exec(delete(ThreadSummary))
+        for root_post, posts, ai_posts, last_at in rows:
+            summary = ThreadSummary(
+                thread_id=root_post.id,
+                language=root_post.language,
+                title=HIDDEN_TITLE if root_post.is_hidden else _preview(root_post.content),
+                name="[Deleted]" if root_post.is_hidden else (root_post.name or ""),
+                reply_count=posts - 1,
+                ai_reply_count=(ai_posts or 0) - (1 if root_post.is_ai else 0),
+                last_at=last_at,
+                is_locked=root_post.is_locked,
+                updated_at=last_at,
+            )
+            session.add(summary)
+        session.commit()
+    return len(rows)
+
+def ensure_thread_summaries():
+    """Startup hook: backfill once on databases created before ThreadSummary existed."""
+    with Session(engine) as session:
+        has_summary = session.exec(select(ThreadSummary.thread_id).limit(1)).first() is not None
+        has_posts = session.exec(select(Post.id).limit(1)).first() is not None
+    if has_posts and not has_summary:
+        rebuild_thread_summaries()
+        return
+    # Rows from before updated_at existed (column added as NULL by init_db)
+    with Session(engine) as session:
+        session.exec(
+            update(ThreadSummary)
+            .where(ThreadSummary.updated_at.is_(None))
+            .values(updated_at=ThreadSummary.last_at)
+        )
+        session.commit()
+
+if __name__ == "__main__":
+    init_db()
+    n = rebuild_thread_summaries()
+    print(f"[Summary] Rebuilt {n} thread summaries")
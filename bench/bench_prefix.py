@@ -0,0 +1,146 @@
+"""
+Benchmark: prompt evaluation per persona fan-out, persona-first vs shared prefix.
+
+    python bench/bench_prefix.py [posts] [personas]
+
+Runs against a local stub of Ollama that simulates its prompt (KV) cache:
+the stub keeps the last prompt it evaluated and only "evaluates" the tokens
+after the longest common prefix, at STUB_MS_PER_TOKEN each. It reports
+prompt_eval_count / prompt_eval_duration like Ollama does.
+
+"before" is the original layout: one /api/generate prompt per persona with
+the persona's system prompt first, so the thread context is re-evaluated for
+every persona. "after" is the current /api/chat layout from app.ai.prompt
+(board rules, context and post shared, role line last). Personas run one
+after another, as on a backend with a single slot.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.ai.personas import board_rules, make_persona  # noqa: E402
+from app.ai.prompt import build_shared, estimate_tokens  # noqa: E402
+from app.http_pool import get_client  # noqa: E402
+from app.ollama_client import OllamaClient  # noqa: E402
+
+STUB_MS_PER_TOKEN = float(os.getenv("STUB_MS_PER_TOKEN", "0.5"))
+MODEL = "bench"
+ROLES = ["contrarian", "joker", "expert", "newbie", "lurker", "optimist"]
+
+
+def render_chat(messages):
+    # Roughly what a chat template produces: messages in order, then the reply header
+    parts = [f"<|{m['role']}|>\n{m['content']}<|end|>\n" for m in messages]
+    return "".join(parts) + "<|assistant|>\n"
+
+
+class PrefixCacheStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    cached = ""
+    lock = threading.Lock()
+    totals = {"requests": 0, "tokens": 0, "eval_s": 0.0}
+
+    @classmethod
+    def reset(cls):
+        cls.cached = ""
+        cls.totals = {"requests": 0, "tokens": 0, "eval_s": 0.0}
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        chat = self.path.endswith("/api/chat")
+        prompt = render_chat(req["messages"]) if chat else req["prompt"]
+
+        with PrefixCacheStub.lock:
+            common = len(os.path.commonprefix([PrefixCacheStub.cached, prompt]))
+            evaluated = estimate_tokens(prompt[common:])
+            seconds = evaluated * STUB_MS_PER_TOKEN / 1000
+            time.sleep(seconds)
+            PrefixCacheStub.cached = prompt
+            totals = PrefixCacheStub.totals
+            totals["requests"] += 1
+            totals["tokens"] += evaluated
+            totals["eval_s"] += seconds
+
+        data = {"done": True, "prompt_eval_count": evaluated, "prompt_eval_duration": int(seconds * 1e9)}
+        if chat:
+            data["message"] = {"role": "assistant", "content": "ok"}
+        else:
+            data["response"] = "ok"
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_posts(n):
+    return [f"user{i % 7}: post {i} about the topic, with an opinion or two and some detail " * 2 for i in range(n)]
+
+
+def run_before(base_url, posts, personas):
+    for i in range(1, len(posts)):
+        context = "\n".join(posts[max(0, i - 20):i])
+        for p in personas:
+            prompt = f"""{p.system_prompt}
+
+(THREAD CONTEXT)
+{context}
+
+(POST)
+{posts[i]}
+
+REPLY:
+"""
+            r = get_client().post(f"{base_url}/api/generate", json={"model": MODEL, "prompt": prompt, "stream": False})
+            r.raise_for_status()
+
+
+def run_after(base_url, posts, personas):
+    client = OllamaClient(mode="http", base_url=base_url, model=MODEL)
+    persona_tokens = max(estimate_tokens(p.instructions) for p in personas)
+    for i in range(1, len(posts)):
+        context = "\n".join(posts[max(0, i - 20):i])
+        shared = build_shared(context, posts[i], MODEL, persona_tokens, system=board_rules("en"))
+        for p in personas:
+            client.chat(shared.for_persona(p.instructions))
+
+
+def main():
+    n_posts = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    n_personas = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    personas = [make_persona("en", f"p{i}", ROLES[i % len(ROLES)]) for i in range(n_personas)]
+    posts = make_posts(n_posts)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PrefixCacheStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"{n_posts - 1} posts x {n_personas} personas, {STUB_MS_PER_TOKEN}ms per evaluated token")
+    print(f"{'layout':<8} {'requests':>9} {'eval tokens':>12} {'eval s':>8} {'wall s':>8}")
+    results = {}
+    for name, run in (("before", run_before), ("after", run_after)):
+        PrefixCacheStub.reset()
+        t0 = time.perf_counter()
+        run(base_url, posts, personas)
+        wall = time.perf_counter() - t0
+        totals = results[name] = PrefixCacheStub.totals
+        print(f"{name:<8} {totals['requests']:>9} {totals['tokens']:>12} {totals['eval_s']:>8.2f} {wall:>8.2f}")
+    server.shutdown()
+
+    if results["after"]["eval_s"]:
+        print(f"prompt-eval speedup: {results['before']['eval_s'] / results['after']['eval_s']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark: build_tree + Renderer.render_tree on synthetic threads.
+
+    python bench/bench_tree.py [max_posts]
+
+Two shapes per size: "chain" (every post replies to the previous one, the
+worst case for recursion) and "random" (each post replies to a random
+earlier post). Per-post cost should stay flat as the thread grows.
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.renderer import Renderer, build_tree  # noqa: E402
+
+
+def make_thread(n, shape, seed=0):
+    rng = random.Random(seed)
+    base = datetime(2026, 1, 1)
+    posts = []
+    for i in range(1, n + 1):
+        if i == 1:
+            parent = None
+        elif shape == "chain":
+            parent = i - 1
+        else:
+            parent = rng.randint(1, i - 1)
+        posts.append(SimpleNamespace(
+            id=i,
+            reply_to_id=parent,
+            created_at=base + timedelta(seconds=i),
+            is_ai=i % 2 == 0,
+            name=f"user{i % 7}",
+            content=f"post body {i} " * 3,
+        ))
+    rng.shuffle(posts)  # DB order is not tree order
+    return posts
+
+
+def run(n, shape):
+    posts = make_thread(n, shape)
+    t0 = time.perf_counter()
+    tree = build_tree(posts)
+    t1 = time.perf_counter()
+    html = Renderer.render_tree(tree, "en")
+    t2 = time.perf_counter()
+    assert html.count("<article") == n
+    return (t1 - t0) * 1000, (t2 - t1) * 1000
+
+
+def main():
+    max_posts = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    sizes = [s for s in (1_000, 10_000, 100_000) if s <= max_posts]
+    print(f"{'shape':<8}{'posts':>9}{'build ms':>11}{'render ms':>11}{'us/post':>9}")
+    for shape in ("chain", "random"):
+        for n in sizes:
+            build_ms, render_ms = run(n, shape)
+            per_post = (build_ms + render_ms) * 1000 / n
+            print(f"{shape:<8}{n:>9}{build_ms:>11.1f}{render_ms:>11.1f}{per_post:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,67 @@
 // app.js (optional)
 // 例: フォーム送信時の確認や、レス番号クリックで >> を自動挿入などを追加できる
+
+// Live AI replies: renders tokens from /{lang}/t/{id}/stream as they arrive,
+// then reloads once the replies are committed as posts.
+(function () {
+  var live = document.getElementById("live-replies");
+  if (!live || !window.EventSource) return;
+  var list = live.querySelector(".live-list");
+  var boxes = {};
+  var es = new EventSource(live.dataset.streamUrl);
+
+  function userIsTyping() {
+    var fields = document.querySelectorAll("textarea");
+    for (var i = 0; i < fields.length; i++) {
+      if (fields[i].value || fields[i] === document.activeElement) return true;
+    }
+    return false;
+  }
+
+  es.addEventListener("start", function (e) {
+    var ev = JSON.parse(e.data);
+    var box = document.createElement("article");
+    box.className = "live-post ai";
+    var head = document.createElement("div");
+    head.className = "name ai-name";
+    head.textContent = "AI-" + ev.name + " (>>" + ev.reply_to + ")";
+    var content = document.createElement("div");
+    content.className = "content";
+    box.appendChild(head);
+    box.appendChild(content);
+    list.appendChild(box);
+    boxes[ev.key] = content;
+    live.hidden = false;
+  });
+
+  es.addEventListener("token", function (e) {
+    var ev = JSON.parse(e.data);
+    var content = boxes[ev.key];
+    if (content) content.textContent += ev.text;
+  });
+
+  es.addEventListener("done", function (e) {
+    var ev = JSON.parse(e.data);
+    if (!ev.post_ids.length) return;
+    if (userIsTyping()) {
+      live.querySelector(".h2").textContent += " ✓";
+      return;
+    }
+    window.location.reload();
+  });
+})();
+
+// Reply forms: the page ships a single <template>; each post's reply box
+// gets its own copy the first time it is opened.
+(function () {
+  var tpl = document.getElementById("reply-form-template");
+  if (!tpl) return;
+  document.addEventListener("toggle", function (e) {
+    var box = e.target;
+    if (!box.classList || !box.classList.contains("replybox") || !box.open) return;
+    if (box.querySelector("form")) return;
+    var form = tpl.content.firstElementChild.cloneNode(true);
+    form.querySelector('input[name="reply_to_id"]').value = box.dataset.replyTo;
+    box.appendChild(form);
+  }, true);
+})();